@@ -1,6 +1,9 @@
 import asyncio
 import json
-import base64
+import logging
+import math
+import time
+import orjson
 import cv2
 import numpy as np
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
@@ -8,174 +11,174 @@ from fastapi.middleware.cors import CORSMiddleware
 from ultralytics import YOLO
 from datetime import datetime
 import sqlite3
-from typing import Dict, List
+from typing import Dict, List, Optional, Set, Tuple, Union
 import threading
-from services import ObjectDetector, CameraManager, AnalyticsManager
+from services import BatchedDetector, BoxTracker, FrameEncoder, ThreadedCapture, detector, camera_manager, analytics_manager
+from ws_manager import ConnectionManager, pack_binary_message
 from main import *
 
+logger = logging.getLogger(__name__)
+
 # Enhanced WebSocket manager for better real-time communication
-class EnhancedConnectionManager:
+class EnhancedConnectionManager(ConnectionManager):
     def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
-        self.camera_subscribers: Dict[int, List[str]] = {}
+        super().__init__()
+        self.camera_subscribers: Dict[int, Set[str]] = {}
 
     async def connect(self, websocket: WebSocket, client_id: str):
-        await websocket.accept()
-        self.active_connections[client_id] = websocket
-        print(f"Client {client_id} connected")
+        await super().connect(websocket, client_id)
+        logger.info(f"Client {client_id} connected")
 
     def disconnect(self, client_id: str):
-        if client_id in self.active_connections:
-            del self.active_connections[client_id]
+        super().disconnect(client_id)
         
         # Remove from camera subscriptions
         for camera_id in list(self.camera_subscribers.keys()):
-            if client_id in self.camera_subscribers[camera_id]:
-                self.camera_subscribers[camera_id].remove(client_id)
-                if not self.camera_subscribers[camera_id]:
-                    del self.camera_subscribers[camera_id]
-        
-        print(f"Client {client_id} disconnected")
-
-    async def send_personal_message(self, message: str, client_id: str):
-        if client_id in self.active_connections:
-            try:
-                await self.active_connections[client_id].send_text(message)
-            except Exception as e:
-                print(f"Error sending message to {client_id}: {e}")
-                self.disconnect(client_id)
-
-    async def broadcast(self, message: str):
-        disconnected_clients = []
-        for client_id, connection in self.active_connections.items():
-            try:
-                await connection.send_text(message)
-            except Exception as e:
-                print(f"Error broadcasting to {client_id}: {e}")
-                disconnected_clients.append(client_id)
+            subscribers = self.camera_subscribers[camera_id]
+            subscribers.discard(client_id)
+            if not subscribers:
+                del self.camera_subscribers[camera_id]
         
-        # Clean up disconnected clients
-        for client_id in disconnected_clients:
-            self.disconnect(client_id)
+        logger.info(f"Client {client_id} disconnected")
 
     async def broadcast_to_camera_subscribers(self, camera_id: int, message: str):
         if camera_id not in self.camera_subscribers:
             return
         
-        disconnected_clients = []
-        for client_id in self.camera_subscribers[camera_id]:
-            try:
-                await self.send_personal_message(message, client_id)
-            except Exception as e:
-                print(f"Error sending camera message to {client_id}: {e}")
-                disconnected_clients.append(client_id)
+        self._send_to_clients(list(self.camera_subscribers[camera_id]), message)
+
+    async def broadcast_bytes_to_camera_subscribers(self, camera_id: int, header: Union[dict, bytes], payload: bytes):
+        if camera_id not in self.camera_subscribers:
+            return
         
-        # Clean up disconnected clients
-        for client_id in disconnected_clients:
-            self.disconnect(client_id)
+        # Pack once; every subscriber queue holds a reference to this same immutable bytes object
+        data = pack_binary_message(header, payload)
+        self._send_to_clients(list(self.camera_subscribers[camera_id]), data)
 
     def subscribe_to_camera(self, client_id: str, camera_id: int):
-        if camera_id not in self.camera_subscribers:
-            self.camera_subscribers[camera_id] = []
-        if client_id not in self.camera_subscribers[camera_id]:
-            self.camera_subscribers[camera_id].append(client_id)
+        self.camera_subscribers.setdefault(camera_id, set()).add(client_id)
 
     def unsubscribe_from_camera(self, client_id: str, camera_id: int):
-        if camera_id in self.camera_subscribers and client_id in self.camera_subscribers[camera_id]:
-            self.camera_subscribers[camera_id].remove(client_id)
-            if not self.camera_subscribers[camera_id]:
+        subscribers = self.camera_subscribers.get(camera_id)
+        if subscribers is not None:
+            subscribers.discard(client_id)
+            if not subscribers:
                 del self.camera_subscribers[camera_id]
 
 # Global enhanced manager
 enhanced_manager = EnhancedConnectionManager()
 
+# Shared encoder and detector so frames from all cameras are batched into one model call
+# and their annotated results into one JPEG encode call. The detector is the services
+# singleton, so the YOLO weights are loaded once per process rather than per camera start.
+frame_encoder = FrameEncoder()
+batched_detector = BatchedDetector(detector, max_batch_size=8, max_wait=0.01,
+                                   encoder=frame_encoder, jpeg_quality=85)
+
+# Adaptive detection interval: run YOLO every Kth frame, with K sized so inference keeps up
+# with this frame time; boxes on the frames in between are moved by optical-flow tracking
+TARGET_FRAME_TIME = 0.033
+MAX_DETECTION_INTERVAL = 10
+
 # Enhanced camera processing with better performance
 async def enhanced_process_camera_frame(camera_id: int, ip_address: str, port: int):
     """Enhanced camera processing with optimized performance"""
-    camera_manager = CameraManager()
-    detector = ObjectDetector()
-    analytics = AnalyticsManager()
-    
-    stream_url = camera_manager.get_ip_webcam_urls(ip_address, port)['video']
+    capture = None
     
     try:
-        cap = cv2.VideoCapture(stream_url)
-        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        cap = camera_manager.open_video_capture(ip_address, port, width=640, height=480)
         cap.set(cv2.CAP_PROP_FPS, 15)  # Increase FPS
         
+        # Blocking cap.read() runs on its own thread; stale frames are dropped there
+        capture = ThreadedCapture(cap).start()
+        
+        # The static parts of every message for this camera, serialized once
+        camera_id_json = orjson.dumps(camera_id)
+        frame_header_prefix = b'{"type":"frame","camera_id":' + camera_id_json + b',"timestamp":'
+        detection_prefix = b'{"type":"detection","camera_id":' + camera_id_json + b','
+        
         frame_skip = 0
-        detection_interval = 3  # Run detection every 3rd frame for performance
+        detection_interval = 3  # Initial guess; adapted from measured inference latency below
+        inference_latency = None
+        tracker = BoxTracker()
         
         while camera_id in active_cameras and active_cameras[camera_id]:
-            ret, frame = cap.read()
-            if not ret:
-                await asyncio.sleep(0.1)
+            frame = await capture.read()
+            if frame is None:
                 continue
             
-            # Optimize frame size
-            frame = cv2.resize(frame, (640, 480))
+            # Optimize frame size (the hardware pipeline already scales on the GPU)
+            if frame.shape[1] != 640 or frame.shape[0] != 480:
+                frame = cv2.resize(frame, (640, 480))
             
             # Skip frames for performance
             frame_skip += 1
-            run_detection = detection_enabled.get(camera_id, False) and (frame_skip % detection_interval == 0)
+            camera_detecting = detection_enabled.get(camera_id, False)
+            run_detection = camera_detecting and (frame_skip % detection_interval == 0)
             
-            annotated_frame = frame.copy()
+            timestamp = datetime.now().isoformat()  # Same ISO-8601 string as every other message, shared by this frame's messages
+            annotated_frame = frame  # Only replaced when the detector returns a drawn copy
+            buffer = None
             object_counts = {}
             detections_data = []
             
             # Run detection if enabled
-            if run_detection and detector.loaded:
-                detection_result = detector.detect_objects(frame, confidence_threshold=0.6)
+            if run_detection and batched_detector.loaded:
+                started = time.perf_counter()
+                detection_result = await batched_detector.submit(frame, confidence_threshold=0.6)
+                latency = time.perf_counter() - started
+                inference_latency = latency if inference_latency is None else 0.8 * inference_latency + 0.2 * latency
+                detection_interval = min(MAX_DETECTION_INTERVAL, max(1, math.ceil(inference_latency / TARGET_FRAME_TIME)))
+                
+                # This frame becomes the tracker's new reference
+                tracker.reset(frame, detection_result['detections'])
+                
                 annotated_frame = detection_result['annotated_frame']
+                buffer = detection_result.get('jpeg')
                 object_counts = detection_result['object_counts']
                 
-                # Convert detections format
-                for detection in detection_result['detections']:
-                    detections_data.append({
-                        'camera_id': camera_id,
-                        'class': detection['class_name'],
-                        'confidence': detection['confidence'],
-                        'bbox': [
-                            detection['bbox']['x1'],
-                            detection['bbox']['y1'],
-                            detection['bbox']['width'],
-                            detection['bbox']['height']
-                        ]
-                    })
+                # Convert detections format, all boxes at once
+                boxes = detection_result['boxes']
+                bboxes = np.hstack((boxes[:, :2], boxes[:, 2:] - boxes[:, :2])).tolist()
+                class_names = [detector.model.names[class_id] for class_id in detection_result['class_ids'].tolist()]
+                detections_data = [
+                    {'camera_id': camera_id, 'class': class_name, 'confidence': confidence, 'bbox': bbox}
+                    for class_name, confidence, bbox in zip(class_names, detection_result['confidences'].tolist(), bboxes)
+                ]
                 
                 # Save analytics
                 if object_counts:
-                    analytics.process_detection_data(camera_id, object_counts)
+                    # Only the history update is needed here, not the summary
+                    analytics_manager.process_detection_data(camera_id, object_counts, summary_fields=set())
                     save_analytics(camera_id, object_counts)
                 
-                # Broadcast detection results
-                await enhanced_manager.broadcast(json.dumps({
-                    'type': 'detection',
-                    'camera_id': camera_id,
+                # Broadcast detection results (splice the dynamic fields after the cached prefix)
+                detection_fields = orjson.dumps({
                     'detections': detections_data,
                     'object_counts': object_counts,
-                    'timestamp': datetime.now().isoformat()
-                }))
+                    'timestamp': timestamp
+                })
+                await enhanced_manager.broadcast((detection_prefix + detection_fields[1:]).decode())
+            elif camera_detecting and tracker.detections:
+                # Between detections, move the last boxes along with the image instead of running YOLO
+                annotated_frame = detector.draw_detections(frame, tracker.update(frame))
+            elif not camera_detecting:
+                tracker.clear()
             
             # Encode and broadcast frame
-            encode_quality = 85 if run_detection else 90  # Better quality when not detecting
-            _, buffer = cv2.imencode('.jpg', annotated_frame, 
-                                   [cv2.IMWRITE_JPEG_QUALITY, encode_quality])
-            frame_base64 = base64.b64encode(buffer).decode('utf-8')
+            if buffer is None:
+                encode_quality = 85 if run_detection else 90  # Better quality when not detecting
+                buffer = frame_encoder.encode(annotated_frame, encode_quality)
             
-            # Broadcast frame to subscribers
-            await enhanced_manager.broadcast_to_camera_subscribers(camera_id, json.dumps({
-                'type': 'frame',
-                'camera_id': camera_id,
-                'frame': frame_base64,
-                'timestamp': datetime.now().isoformat()
-            }))
+            # Broadcast raw JPEG to subscribers as a binary message (no base64/JSON wrapping)
+            frame_header = frame_header_prefix + orjson.dumps(timestamp) + b'}'
+            await enhanced_manager.broadcast_bytes_to_camera_subscribers(camera_id, frame_header, buffer)
             
             # Adaptive sleep based on detection status
             await asyncio.sleep(0.033 if run_detection else 0.066)  # ~30 FPS detecting, ~15 FPS idle
             
     except Exception as e:
-        print(f"Error in enhanced camera processing {camera_id}: {e}")
+        logger.error(f"Error in enhanced camera processing {camera_id}: {e}")
         
         # Send error message
         await enhanced_manager.broadcast(json.dumps({
@@ -185,7 +188,9 @@ async def enhanced_process_camera_frame(camera_id: int, ip_address: str, port: i
             'timestamp': datetime.now().isoformat()
         }))
     finally:
-        if 'cap' in locals():
+        if capture is not None:
+            capture.stop()  # The reader thread releases the capture
+        elif 'cap' in locals():
             cap.release()
 
 # Enhanced WebSocket endpoint
@@ -237,7 +242,7 @@ async def enhanced_websocket_endpoint(websocket: WebSocket, client_id: str):
             except WebSocketDisconnect:
                 break
             except Exception as e:
-                print(f"Error handling message from {client_id}: {e}")
+                logger.error(f"Error handling message from {client_id}: {e}")
                 break
                 
     except WebSocketDisconnect:
@@ -250,23 +255,49 @@ async def process_camera_frame(camera_id: int, ip_address: str, port: int):
     """Use enhanced processing"""
     await enhanced_process_camera_frame(camera_id, ip_address, port)
 
+# Camera address cache: camera_id -> (ip_address, port)
+camera_cache: Dict[int, Tuple[str, int]] = {}
+_camera_db: Optional[sqlite3.Connection] = None
+_camera_db_lock = threading.Lock()
+
+def _fetch_camera_row(camera_id: int) -> Optional[Tuple[str, int]]:
+    """Look up one camera on the shared SQLite connection (runs in a worker thread)"""
+    global _camera_db
+    with _camera_db_lock:
+        if _camera_db is None:
+            _camera_db = sqlite3.connect('cameras.db', check_same_thread=False)
+        cursor = _camera_db.execute('SELECT ip_address, port FROM cameras WHERE id = ?', (camera_id,))
+        return cursor.fetchone()
+
+async def get_camera_address(camera_id: int) -> Optional[Tuple[str, int]]:
+    """Return (ip_address, port) for a camera, hitting the database only on a cache miss"""
+    if camera_id in camera_cache:
+        return camera_cache[camera_id]
+    
+    camera_data = await asyncio.to_thread(_fetch_camera_row, camera_id)
+    if camera_data:
+        camera_cache[camera_id] = camera_data
+    return camera_data
+
+def invalidate_camera_cache(camera_id: Optional[int] = None):
+    """Drop one cached camera (or all of them) after the cameras table changes"""
+    if camera_id is None:
+        camera_cache.clear()
+    else:
+        camera_cache.pop(camera_id, None)
+
 # Update camera start function to use enhanced processing
 @app.post("/cameras/{camera_id}/start")
 async def enhanced_start_camera(camera_id: int):
     """Enhanced camera start with better error handling"""
-    conn = sqlite3.connect('cameras.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT ip_address, port FROM cameras WHERE id = ?', (camera_id,))
-    camera_data = cursor.fetchone()
-    conn.close()
+    camera_data = await get_camera_address(camera_id)
     
     if not camera_data:
         raise HTTPException(status_code=404, detail="Camera not found")
     
     if camera_id not in active_cameras:
         # Test camera connection first
-        camera_manager = CameraManager()
-        if not camera_manager.test_camera_connection(camera_data[0], camera_data[1]):
+        if not await camera_manager.test_camera_connection(camera_data[0], camera_data[1]):
             raise HTTPException(status_code=400, detail="Cannot connect to camera")
         
         active_cameras[camera_id] = True
@@ -284,6 +315,10 @@ async def enhanced_start_camera(camera_id: int):
     
     return {"message": "Camera started"}
 
+@app.on_event("shutdown")
+async def flush_pending_detections():
+    """Write detection records still queued in memory before the server exits"""
+    await analytics_manager.close()
+
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    run_server(app)
\ No newline at end of file
@@ -0,0 +1,30 @@
+"""
+Non-blocking logging for the backend
+
+Handlers put log records on an in-memory queue and a QueueListener thread writes them to stderr,
+so request handlers and camera loops never wait on a slow terminal or pipe.
+"""
+import atexit
+import logging
+import logging.handlers
+import queue
+
+_listener = None
+
+def configure_logging(level: int = logging.INFO):
+    """Route the root logger through a queue; safe to call more than once"""
+    global _listener
+    if _listener is not None:
+        return
+    
+    log_queue = queue.Queue(-1)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    # Drain whatever is still queued when the interpreter exits
+    atexit.register(_listener.stop)
+    
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(level)
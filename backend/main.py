@@ -5,22 +5,42 @@ from fastapi.responses import StreamingResponse
 from fastapi.background import BackgroundTasks
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import asyncio
-import json
+import contextlib
+import math
+from collections import Counter, defaultdict
+import orjson
 import cv2
 import numpy as np
 from ultralytics import YOLO
 from datetime import datetime, timedelta
-import base64
-from typing import Dict, List, Optional
+import glob
+import shutil
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context, shared_memory
 from pydantic import BaseModel
-import requests
 import os
+import random
 from dotenv import load_dotenv
+from cachetools import TTLCache
 from google.cloud import firestore
 import google.generativeai as genai
 from google.cloud.firestore import AsyncClient, Query
+from google.api_core.exceptions import FailedPrecondition
 import firebase_admin
 from firebase_admin import credentials, auth
+import inference_worker
+import logging
+from log_queue import configure_logging
+from ws_manager import ConnectionManager, pack_binary_message
+import services
+from services import BatchedDetector
+
+# Log through a background thread so handlers never block on stdout/stderr
+configure_logging()
+logger = logging.getLogger(__name__)
 
 # Initialize FastAPI app
 app = FastAPI(title="YOLO Object Detection API", version="1.0.0")
@@ -34,16 +54,100 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Load environment variables
+load_dotenv()
+
+# Inference backend: "pytorch" (default) or "openvino" (OpenVINO IR, fastest on Intel CPUs)
+YOLO_BACKEND = os.getenv("YOLO_BACKEND", "pytorch").lower()
+
+# Frames are resized to 640x480 before detection
+FRAME_SHAPE = (480, 640)
+
+# Network input width. 416 needs ~2.4x fewer FLOPs than 640 and is usually enough for
+# surveillance views; the height keeps the 4:3 frame aspect, rounded up to a multiple of 32
+INFERENCE_SIZE = int(os.getenv("INFERENCE_SIZE", "416"))
+INFERENCE_IMGSZ = (math.ceil(INFERENCE_SIZE * FRAME_SHAPE[0] / FRAME_SHAPE[1] / 32) * 32, INFERENCE_SIZE)
+
+# Directory of JPEG frames saved from the real cameras (~100 is enough). When set with the
+# OpenVINO backend, the IR is quantized to INT8 with NNCF on first start.
+OPENVINO_INT8_CALIBRATION_DIR = os.getenv("OPENVINO_INT8_CALIBRATION_DIR")
+
+def quantize_openvino_model(model_dir: str, calibration_dir: str) -> Optional[str]:
+    """Post-training quantize an OpenVINO IR to INT8, calibrated on sample camera frames"""
+    int8_dir = model_dir.replace('_openvino_model', '_int8_openvino_model')
+    if os.path.isdir(int8_dir):
+        return int8_dir
+    
+    try:
+        import nncf
+        from openvino.runtime import Core, serialize
+        
+        frame_paths = sorted(glob.glob(os.path.join(calibration_dir, '*.jpg')))[:300]
+        if not frame_paths:
+            logger.warning(f"No calibration frames found in {calibration_dir}, skipping INT8 quantization")
+            return None
+        
+        def to_model_input(path: str) -> np.ndarray:
+            # Same input Ultralytics feeds the IR: RGB, NCHW, float32 in [0, 1]
+            frame = cv2.resize(cv2.imread(path), (INFERENCE_IMGSZ[1], INFERENCE_IMGSZ[0]))
+            return np.ascontiguousarray(frame[..., ::-1].transpose(2, 0, 1))[None].astype(np.float32) / 255.0
+        
+        logger.info(f"Quantizing {model_dir} to INT8 with {len(frame_paths)} calibration frames...")
+        model_xml = glob.glob(os.path.join(model_dir, '*.xml'))[0]
+        quantized_model = nncf.quantize(
+            Core().read_model(model_xml),
+            nncf.Dataset(frame_paths, to_model_input),
+            preset=nncf.QuantizationPreset.MIXED,
+            subset_size=len(frame_paths),
+            # Keep the box decoding in the detection head in floating point
+            ignored_scope=nncf.IgnoredScope(types=['Multiply', 'Subtract', 'Sigmoid'])
+        )
+        
+        os.makedirs(int8_dir)
+        serialize(quantized_model, os.path.join(int8_dir, os.path.basename(model_xml)))
+        shutil.copy(os.path.join(model_dir, 'metadata.yaml'), int8_dir)  # class names for Ultralytics
+        return int8_dir
+    except Exception as e:
+        logger.error(f"Error quantizing OpenVINO model: {e}")
+        return None
+
+def load_yolo_model(model_name: str) -> Tuple[YOLO, str]:
+    """
+    Load YOLO weights, exporting them once to OpenVINO IR (optionally INT8) when that backend is selected
+    
+    Returns:
+        Tuple of (model, path the model was loaded from)
+    """
+    if YOLO_BACKEND == 'openvino':
+        model_dir = os.path.splitext(model_name)[0] + '_openvino_model'
+        try:
+            if not os.path.isdir(model_dir):
+                logger.info(f"Exporting {model_name} to OpenVINO IR...")
+                model_dir = YOLO(model_name).export(format='openvino', imgsz=INFERENCE_IMGSZ, half=True, dynamic=True)
+            if OPENVINO_INT8_CALIBRATION_DIR:
+                model_dir = quantize_openvino_model(model_dir, OPENVINO_INT8_CALIBRATION_DIR) or model_dir
+            return YOLO(model_dir, task='detect'), model_dir
+        except Exception as e:
+            logger.warning(f"Error loading OpenVINO model, falling back to PyTorch: {e}")
+    return YOLO(model_name), model_name
+
+# The spawned inference worker re-imports this script as __mp_main__ when it is run directly;
+# that process only needs inference_worker, so skip loading the model and cloud clients there
+SPAWNED_WORKER = __name__ == '__mp_main__'
+
 # Load YOLO model
 try:
-    model = YOLO('yolov8n.pt')  # You can use yolov8s.pt, yolov8m.pt, yolov8l.pt, yolov8x.pt for better accuracy
-    print("YOLO model loaded successfully")
+    if SPAWNED_WORKER:
+        model = model_path = None
+    else:
+        model, model_path = load_yolo_model('yolov8n.pt')  # You can use yolov8s.pt, yolov8m.pt, yolov8l.pt, yolov8x.pt for better accuracy
+        logger.info("YOLO model loaded successfully")
 except Exception as e:
-    print(f"Error loading YOLO model: {e}")
-    model = None
+    logger.error(f"Error loading YOLO model: {e}")
+    model = model_path = None
 
-# Load environment variables
-load_dotenv()
+# Class names indexed by class id, copied once out of the model's dict
+CLASS_NAMES = tuple(model.names[i] for i in range(len(model.names))) if model is not None else ()
 
 # Google Cloud Configuration
 PROJECT_ID = os.getenv("GOOGLE_CLOUD_PROJECT_ID")
@@ -52,21 +156,23 @@ GOOGLE_API_KEY = "AIz######################8"
 # Initialize Firebase Admin SDK
 try:
     # Check if Firebase app is already initialized
-    if not firebase_admin._apps:
+    if SPAWNED_WORKER:
+        pass
+    elif not firebase_admin._apps:
         # Use the service account key file
         service_account_path = "detect-da43f-firebase-adminsdk-fbsvc-75c3b85e23.json"
         if os.path.exists(service_account_path):
             cred = credentials.Certificate(service_account_path)
             firebase_admin.initialize_app(cred)
-            print("Firebase Admin SDK initialized with service account")
+            logger.info("Firebase Admin SDK initialized with service account")
         else:
             # Fallback to default credentials
             firebase_admin.initialize_app()
-            print("Firebase Admin SDK initialized with default credentials")
+            logger.info("Firebase Admin SDK initialized with default credentials")
     else:
-        print("Firebase Admin SDK already initialized")
+        logger.info("Firebase Admin SDK already initialized")
 except Exception as e:
-    print(f"Warning: Firebase Admin SDK initialization failed: {e}")
+    logger.warning(f"Firebase Admin SDK initialization failed: {e}")
 
 # Security scheme for authentication
 security = HTTPBearer()
@@ -79,7 +185,7 @@ async def verify_firebase_token(credentials: HTTPAuthorizationCredentials = Depe
         decoded_token = auth.verify_id_token(credentials.credentials)
         return decoded_token
     except Exception as e:
-        print(f"Authentication error: {e}")
+        logger.error(f"Authentication error: {e}")
         raise HTTPException(
             status_code=401,
             detail="Invalid authentication token"
@@ -102,30 +208,72 @@ async def get_current_user(request: Request, credentials: HTTPAuthorizationCrede
 
 # Initialize Firestore
 try:
-    if PROJECT_ID:
+    if SPAWNED_WORKER:
+        db = None
+    elif PROJECT_ID:
         db = firestore.AsyncClient(project=PROJECT_ID)
-        print(f"Firestore client initialized for project: {PROJECT_ID}")
+        logger.info(f"Firestore client initialized for project: {PROJECT_ID}")
     else:
-        print("Warning: GOOGLE_CLOUD_PROJECT_ID not found in environment")
+        logger.warning("GOOGLE_CLOUD_PROJECT_ID not found in environment")
         db = None
 except Exception as e:
-    print(f"Error initializing Firestore: {e}")
+    logger.error(f"Error initializing Firestore: {e}")
     db = None
 
 # Initialize Gemini AI
 try:
-    if GOOGLE_API_KEY:
+    if SPAWNED_WORKER:
+        gemini_client = None
+    elif GOOGLE_API_KEY:
         from google import genai
         # Initialize the Gemini client
         gemini_client = genai.Client()
-        print("Gemini AI client initialized successfully")
+        logger.info("Gemini AI client initialized successfully")
     else:
-        print("Warning: GOOGLE_API_KEY not found in environment")
+        logger.warning("GOOGLE_API_KEY not found in environment")
         gemini_client = None
 except Exception as e:
-    print(f"Error initializing Gemini AI client: {e}")
+    logger.error(f"Error initializing Gemini AI client: {e}")
     gemini_client = None
 
+GEMINI_MODEL = "gemini-2.5-flash"
+
+CHAT_ROLE = "You are an AI assistant for a YOLO object detection system. Help users analyze their camera analytics data."
+
+CHAT_FORMATTING_GUIDE = """IMPORTANT FORMATTING GUIDELINES:
+- Use clear structure with bullet points (•) and numbered lists
+- Include relevant emojis for visual appeal
+- Use line breaks for better readability
+- Highlight key numbers and insights with **bold** formatting
+- Use sections like "📊 Summary:", "🔍 Details:", "💡 Insights:" when appropriate
+- Keep responses under 200 words but well-organized
+- Use markdown-style formatting that will display nicely in chat
+
+Example format:
+📊 **Detection Summary:**
+• Total objects detected: **24**
+• Most common: **chair** (8 detections)
+• Activity level: **High**
+
+🎯 **Key Insights:**
+• Peak detection time: Morning hours
+• Detection accuracy: 95%
+
+💡 **Recommendations:**
+• Consider adjusting sensitivity for better results
+
+Provide a helpful, beautifully formatted response based on the available analytics data."""
+
+# Invariant instructions go first so consecutive requests share a prefix Gemini can cache implicitly;
+# nothing user- or request-specific may appear in STATIC_PREAMBLE
+STATIC_PREAMBLE = f"{CHAT_ROLE}\n\n{CHAT_FORMATTING_GUIDE}\n\n"
+# The per-request tail is joined from fixed pieces around the context data and the question
+DYNAMIC_TAIL_PARTS = ("Context information:\n", "\n\nUser question: ")
+
+# Answers to repeated questions, keyed by (user, camera, normalized question, total detections, object types);
+# answers built from an unavailable analytics context are never cached
+CHAT_RESPONSE_CACHE = TTLCache(maxsize=1024, ttl=45)
+
 # Firestore Collections
 # Collections will be created automatically when first document is added:
 # - cameras: camera configuration
@@ -137,11 +285,11 @@ except Exception as e:
 async def init_firestore_collections():
     """Initialize Firestore collections if they don't exist"""
     if not db:
-        print("Firestore client not initialized")
+        logger.info("Firestore client not initialized")
         return
     
-    print("Firestore collections will be created automatically when first documents are added")
-    print("Collections: cameras, detections, analytics, hourly_analytics, chat_history")
+    logger.info("Firestore collections will be created automatically when first documents are added")
+    logger.info("Collections: cameras, detections, analytics, hourly_analytics, chat_history")
 
 # Pydantic models
 class Camera(BaseModel):
@@ -177,25 +325,378 @@ detection_enabled = {}
 camera_settings = {}  # Store per-camera object filtering settings
 
 # WebSocket connection manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+manager = ConnectionManager()
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+# Run inference in a separate process (frames shared through shared memory) instead of a thread
+INFERENCE_PROCESS = os.getenv("INFERENCE_PROCESS", "false").lower() == "true"
+INFERENCE_PROCESS_THREADS = int(os.getenv("INFERENCE_PROCESS_THREADS", "2"))
+
+# YOLO backend for services.BatchedDetector, which batches frames from every camera into one forward pass
+class InferenceBackend:
+    def __init__(self, max_batch_size: int = 8, use_process: bool = False):
+        self.max_batch_size = max_batch_size
+        self._infer_kwargs = {'imgsz': INFERENCE_IMGSZ, 'verbose': False}
+        self._use_process = use_process
+        self._executor = None
+        self._shared_memory = None
+        self._detect = None
+    
+    @property
+    def loaded(self) -> bool:
+        return model is not None
+    
+    def open(self):
+        """Create the inference process and its frame buffer; called from the startup event rather than at import time"""
+        if self._use_process and self._executor is None:
+            # BatchedDetector runs one batch at a time, so a single frame buffer is enough
+            frames_shape = (self.max_batch_size, FRAME_SHAPE[0], FRAME_SHAPE[1], 3)
+            self._shared_memory = shared_memory.SharedMemory(create=True, size=int(np.prod(frames_shape)))
+            self._frames = np.ndarray(frames_shape, dtype=np.uint8, buffer=self._shared_memory.buf)
+            self._executor = ProcessPoolExecutor(
+                max_workers=1, mp_context=get_context('spawn'), initializer=inference_worker.init_worker,
+                initargs=(model_path, self._shared_memory.name, frames_shape, self._infer_kwargs, INFERENCE_PROCESS_THREADS)
+            )
+        elif not self._use_process and self._detect is None and model_path and os.path.isdir(model_path):
+            # OpenVINO IR: preprocess with OpenCV and decode ourselves instead of using the Ultralytics predictor
+            try:
+                self._detect = inference_worker.OpenVINODetector(model_path, INFERENCE_IMGSZ)
+            except Exception as e:
+                logger.warning(f"Error compiling {model_path} directly, using Ultralytics predictor: {e}")
+    
+    def detect_batch(self, frames: List[np.ndarray], thresholds: List[float]):
+        """Detect objects in a batch; returns (xyxy, confidences, class_ids) arrays per frame"""
+        # NMS filters at the lowest threshold in the batch; each camera applies its own afterwards
+        conf = min(thresholds)
+        if self._executor is not None:
+            for slot, frame in zip(self._frames, frames):
+                slot[...] = frame
+            return self._executor.submit(inference_worker.infer, len(frames), conf).result()
+        if self._detect is not None:
+            return self._detect(frames, conf)
+        results = model.predict(frames, conf=conf, **self._infer_kwargs)
+        return [inference_worker.result_arrays(result) for result in results]
+    
+    @staticmethod
+    def _empty_result(frame: np.ndarray):
+        return np.empty((0, 4), dtype=np.float32), np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int32)
+    
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self._shared_memory is not None:
+            self._shared_memory.close()
+            self._shared_memory.unlink()
+            self._shared_memory = None
+
+inference_backend = InferenceBackend(use_process=INFERENCE_PROCESS and model is not None)
+# The Ultralytics predictor is not thread-safe; BatchedDetector runs every batch on its single inference thread
+inference_batcher = BatchedDetector(inference_backend, max_batch_size=inference_backend.max_batch_size, max_wait=0.02)
+
+def postprocess_boxes(xyxy: np.ndarray, confidences: np.ndarray, class_ids: np.ndarray,
+                      threshold: float, num_classes: int):
+    """
+    Keep the boxes above the confidence threshold and count them per class
+    
+    Returns:
+        Tuple of (Nx4 int32 xyxy boxes, confidences, int32 class ids, per-class counts)
+    """
+    keep = confidences > threshold
+    class_ids = class_ids[keep]
+    return xyxy[keep].astype(np.int32), confidences[keep], class_ids, np.bincount(class_ids, minlength=num_classes)
+
+def _postprocess_boxes_loop(xyxy, confidences, class_ids, threshold, num_classes):
+    # Single-pass version of postprocess_boxes for Numba to compile
+    n = confidences.shape[0]
+    boxes = np.empty((n, 4), dtype=np.int32)
+    kept_confidences = np.empty(n, dtype=confidences.dtype)
+    kept_class_ids = np.empty(n, dtype=np.int32)
+    counts = np.zeros(num_classes, dtype=np.int64)
+    kept = 0
+    for i in range(n):
+        if confidences[i] > threshold:
+            for j in range(4):
+                boxes[kept, j] = np.int32(xyxy[i, j])
+            kept_confidences[kept] = confidences[i]
+            kept_class_ids[kept] = class_ids[i]
+            counts[class_ids[i]] += 1
+            kept += 1
+    return boxes[:kept], kept_confidences[:kept], kept_class_ids[:kept], counts
+
+# With Numba installed the post-processing runs as compiled code without holding the GIL
+try:
+    from numba import njit
+    _compiled_postprocess = njit(nogil=True, cache=True)(_postprocess_boxes_loop)
+    # Compile now (or load the cached build) rather than on the first camera frame
+    _compiled_postprocess(np.zeros((1, 4), dtype=np.float32), np.ones(1, dtype=np.float32),
+                          np.zeros(1, dtype=np.int32), 0.5, 80)
+    postprocess_boxes = _compiled_postprocess
+except Exception as e:
+    logger.warning(f"Numba unavailable, post-processing detections with NumPy: {e}")
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+# libjpeg-turbo (SIMD) for frame encoding, falling back to OpenCV when it is not installed
+try:
+    from turbojpeg import TurboJPEG, TJFLAG_FASTDCT
+    turbo_jpeg = TurboJPEG()
+except Exception as e:
+    logger.warning(f"TurboJPEG unavailable, encoding frames with OpenCV: {e}")
+    turbo_jpeg = None
+
+# Encoding runs off the event loop; both encoders release the GIL, so cameras encode in parallel
+jpeg_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='jpeg-encode')
+
+def encode_jpeg(frame: np.ndarray, quality: int = 80) -> bytes:
+    """Encode a BGR frame to JPEG bytes"""
+    if turbo_jpeg:
+        return turbo_jpeg.encode(frame, quality=quality, flags=TJFLAG_FASTDCT)
+    _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer.tobytes()
+
+# Seconds between batched analytics writes
+ANALYTICS_FLUSH_INTERVAL = 5.0
+# Analytics records are spread over this many shards so unindexed scans can run in parallel
+ANALYTICS_SHARDS = 8
+# Most analytics documents one unindexed fallback read may fetch
+ANALYTICS_FALLBACK_LIMIT = 1000
+
+# Accumulates per-camera object counts in memory and writes them to Firestore in one batch
+class AnalyticsBuffer:
+    def __init__(self, flush_interval: float = ANALYTICS_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._pending: Dict[str, dict] = defaultdict(self._new_entry)
+        self._hourly_refs: Dict[tuple, Optional[firestore.AsyncDocumentReference]] = {}  # (camera_id, hour_key) -> doc
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, camera_id: str, user_id: Optional[str], object_counts: Dict[str, int]):
+        """Merge one frame's counts into the camera's pending totals"""
+        if not db:
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_loop())
+        
+        entry = self._pending[camera_id]
+        entry['user_id'] = user_id
+        entry['object_counts'].update(object_counts)
+        entry['frames'] += 1
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message)
-            except:
-                pass
+    @staticmethod
+    def _new_entry() -> dict:
+        # Only built the first time a camera reports in each flush interval
+        return {'user_id': None, 'object_counts': Counter(), 'frames': 0}
 
-manager = ConnectionManager()
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def _get_hourly_ref(self, camera_id: str, hour_key: str):
+        """Find this hour's aggregate document once; later flushes reuse the cached reference"""
+        key = (camera_id, hour_key)
+        if key not in self._hourly_refs:
+            query = db.collection('hourly_analytics').where('camera_id', '==', camera_id).where('hour_key', '==', hour_key).limit(1)
+            existing_docs = [doc async for doc in query.stream()]
+            # Drop references for earlier hours
+            self._hourly_refs = {k: ref for k, ref in self._hourly_refs.items() if k[1] == hour_key}
+            self._hourly_refs[key] = existing_docs[0].reference if existing_docs else None
+        return self._hourly_refs[key]
+
+    async def flush(self):
+        """Write all pending counts: one analytics record and one hourly increment per camera"""
+        if not db or not self._pending:
+            return
+        
+        pending, self._pending = self._pending, defaultdict(self._new_entry)
+        now = datetime.now()
+        hour_key = now.strftime('%Y-%m-%d %H:00')
+        
+        try:
+            batch = db.batch()
+            for camera_id, entry in pending.items():
+                user_id = entry['user_id']
+                object_counts = dict(entry['object_counts'])
+                total_count = sum(object_counts.values())
+                
+                batch.create(db.collection('analytics').document(), {
+                    'camera_id': camera_id,
+                    'user_id': user_id,  # Add user_id for isolation
+                    'object_counts': object_counts,
+                    'frames': entry['frames'],
+                    'timestamp': now.isoformat(),
+                    'shard': random.randrange(ANALYTICS_SHARDS)  # Lets readers split scans into parallel queries
+                })
+                
+                # Increment the hourly aggregate in place instead of read-modify-write
+                hourly_ref = await self._get_hourly_ref(camera_id, hour_key)
+                increments = {
+                    'object_counts': {obj_type: firestore.Increment(count) for obj_type, count in object_counts.items()},
+                    'total_detections': firestore.Increment(total_count)
+                }
+                if hourly_ref is None:
+                    hourly_ref = db.collection('hourly_analytics').document()
+                    self._hourly_refs[(camera_id, hour_key)] = hourly_ref
+                    increments.update({
+                        'camera_id': camera_id,
+                        'user_id': user_id,  # Add user_id for isolation
+                        'hour_key': hour_key,
+                        'created_at': now.isoformat()
+                    })
+                batch.set(hourly_ref, increments, merge=True)
+            
+            await batch.commit()
+            logger.info(f"Saved analytics for {len(pending)} camera(s)")
+        except Exception as db_error:
+            logger.exception(f"Error saving analytics: {db_error}")
+            logger.error(f"Object counts that failed to save: {pending}")
+            self._hourly_refs.clear()  # Documents created in the failed batch do not exist
+
+analytics_buffer = AnalyticsBuffer()
+
+# Camera stream decoder: "pyav" (FFmpeg through PyAV, default) or "opencv"
+CAMERA_DECODER = os.getenv("CAMERA_DECODER", "pyav").lower()
+
+class PyAVCapture:
+    """
+    Reads an IP camera stream with FFmpeg (PyAV), keeping only the newest image
+    
+    A background thread demuxes the stream. MJPEG packets are independent images, so
+    only the packet that is actually read gets decoded and the rest are dropped undecoded;
+    other codecs are decoded as they arrive.
+    """
+    def __init__(self, url: str, width: int = 640, height: int = 480):
+        import av
+        self.width = width
+        self.height = height
+        self.container = av.open(url, options={'fflags': 'nobuffer', 'flags': 'low_delay'}, timeout=5.0)
+        self.stream = self.container.streams.video[0]
+        self.intra_only = self.stream.codec_context.name == 'mjpeg'
+        if not self.intra_only:
+            self.stream.thread_type = 'AUTO'
+        self._latest = None  # Newest undecoded packet (MJPEG) or decoded frame
+        self._condition = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._demux, daemon=True)
+        self._thread.start()
+
+    def _demux(self):
+        try:
+            for packet in self.container.demux(self.stream):
+                if not self._running:
+                    break
+                if packet.size == 0:
+                    continue
+                if self.intra_only:
+                    latest = packet
+                else:
+                    frames = packet.decode()
+                    if not frames:
+                        continue
+                    latest = frames[-1]
+                with self._condition:
+                    self._latest = latest
+                    self._condition.notify()
+        except Exception as e:
+            logger.info(f"Camera stream stopped: {e}")
+        finally:
+            self._running = False
+            with self._condition:
+                self._condition.notify_all()
+            self.container.close()
+
+    def read(self, timeout: float = 1.0):
+        """Return (ret, frame) like cv2.VideoCapture.read, waiting briefly for a new image"""
+        with self._condition:
+            if self._latest is None and self._running:
+                self._condition.wait(timeout)
+            latest, self._latest = self._latest, None
+        if latest is None:
+            return False, None
+        
+        if self.intra_only:
+            frames = self.stream.codec_context.decode(latest)
+            if not frames:
+                return False, None
+            latest = frames[-1]
+        # swscale converts to BGR and scales to the processing size in one pass
+        return True, latest.to_ndarray(width=self.width, height=self.height, format='bgr24')
+
+    def release(self):
+        self._running = False
+
+class OpenCVCapture:
+    """
+    cv2.VideoCapture that grab()s continuously in a background thread and only retrieve()s on read
+    
+    Grabbing keeps the stream current without building up stale frames; frames that are never
+    read skip retrieve(), i.e. the conversion to BGR.
+    """
+    def __init__(self, url: str):
+        self.cap = cv2.VideoCapture(url)
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        # VideoCapture is not thread-safe: the condition guards the flags that keep grab() and retrieve()
+        # apart, but is never held during the blocking calls themselves
+        self._condition = threading.Condition()
+        self._grabbed = False  # A grabbed frame is waiting to be retrieved
+        self._grabbing = False
+        self._retrieving = False
+        self._readers = 0
+        self._running = True
+        self._thread = threading.Thread(target=self._grab_loop, daemon=True)
+        self._thread.start()
+
+    def _grab_loop(self):
+        while True:
+            with self._condition:
+                # Pause while a reader retrieves, or while one is waiting for the frame just grabbed
+                self._condition.wait_for(
+                    lambda: not self._running or not (self._retrieving or (self._grabbed and self._readers))
+                )
+                if not self._running:
+                    return
+                self._grabbing = True
+            grabbed = self.cap.grab()
+            with self._condition:
+                self._grabbing = False
+                self._grabbed = grabbed
+                self._condition.notify_all()
+            if not grabbed:
+                time.sleep(0.5)
+
+    def read(self, timeout: float = 1.0):
+        """Return (ret, frame) like cv2.VideoCapture.read, waiting at most for the grab in progress"""
+        with self._condition:
+            self._readers += 1
+            try:
+                ready = self._condition.wait_for(lambda: self._grabbed and not self._grabbing, timeout)
+            finally:
+                self._readers -= 1
+            if not ready:
+                self._condition.notify_all()
+                return False, None
+            self._grabbed = False
+            self._retrieving = True
+        try:
+            return self.cap.retrieve()
+        finally:
+            with self._condition:
+                self._retrieving = False
+                self._condition.notify_all()
+
+    def release(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        self._thread.join(timeout=2.0)
+        self.cap.release()
+
+def open_camera_stream(stream_url: str):
+    """Open a camera stream with PyAV, falling back to OpenCV"""
+    if CAMERA_DECODER == 'pyav':
+        try:
+            return PyAVCapture(stream_url)
+        except Exception as e:
+            logger.warning(f"PyAV could not open {stream_url}, using OpenCV: {e}")
+    
+    return OpenCVCapture(stream_url)
 
 # Camera management functions
 def get_camera_stream_url(ip_address: str, port: int) -> str:
@@ -205,24 +706,36 @@ def get_camera_stream_url(ip_address: str, port: int) -> str:
 async def process_camera_frame(camera_id: str, ip_address: str, port: int):
     """Process frames from IP camera"""
     stream_url = get_camera_stream_url(ip_address, port)
+    user_id = active_cameras.get(camera_id, {}).get('user_id')
+    pending_detection: Optional[asyncio.Task] = None
     
     try:
-        cap = cv2.VideoCapture(stream_url)
-        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        # Opening and reading block on the network, so they run off the event loop
+        cap = await asyncio.to_thread(open_camera_stream, stream_url)
+        # Resized frames are written into the same buffer every iteration; each frame is drawn and
+        # encoded before the next one is read, and detection works on its own copy
+        resize_buffer = np.empty((*FRAME_SHAPE, 3), dtype=np.uint8)
+        # At most one frame per camera is being detected at a time. Frames read while it is in
+        # flight are still streamed, drawn with the boxes of the latest finished detection.
+        overlay = None  # (xyxy, selected, labels) from the latest finished detection
         
         while camera_id in active_cameras and active_cameras[camera_id]:
-            ret, frame = cap.read()
+            ret, frame = await asyncio.to_thread(cap.read)
             if not ret:
                 await asyncio.sleep(1)
                 continue
             
-            # Resize frame for processing
-            frame = cv2.resize(frame, (640, 480))
+            # Resize frame for processing (PyAV already delivers 640x480)
+            if frame.shape[:2] != FRAME_SHAPE:
+                frame = cv2.resize(frame, (FRAME_SHAPE[1], FRAME_SHAPE[0]), dst=resize_buffer)
             
             # Object detection if enabled
-            if detection_enabled.get(camera_id, False) and model:
-                results = model(frame)
-                
+            if not (detection_enabled.get(camera_id, False) and model is not None):
+                if pending_detection is not None:
+                    pending_detection.cancel()
+                    pending_detection = None
+                overlay = None
+            else:
                 # Get camera settings for filtering
                 cam_settings = camera_settings.get(camera_id, {
                     'enabled_objects': ['person', 'car', 'truck', 'bus', 'motorcycle', 'bicycle'],
@@ -234,155 +747,94 @@ async def process_camera_frame(camera_id: str, ip_address: str, port: int):
                 threshold = cam_settings.get('detection_threshold', 0.5)
                 show_boxes = cam_settings.get('show_bounding_boxes', True)
                 
-                # Process detections - DETECT ALL OBJECTS
-                object_counts = {}
-                detections_data = []
-                
-                for result in results:
-                    boxes = result.boxes
-                    if boxes is not None:
-                        for box in boxes:
-                            # Extract detection data
-                            x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                            confidence = box.conf[0].cpu().numpy()
-                            class_id = int(box.cls[0].cpu().numpy())
-                            class_name = model.names[class_id]
-                            
-                            # Show ALL objects that meet confidence threshold
-                            if confidence > threshold:
-                                # Count ALL objects
-                                object_counts[class_name] = object_counts.get(class_name, 0) + 1
-                                
-                                # Check if this object is in the selected list
-                                is_selected = (len(enabled_objects) == 0 or class_name in enabled_objects)
-                                
-                                # Draw bounding box if enabled
-                                if show_boxes:
-                                    # RED boxes for SELECTED objects, GREEN for all others
-                                    if is_selected:
-                                        color = (0, 0, 255)  # RED for selected objects
-                                        thickness = 3
-                                    else:
-                                        color = (0, 255, 0)  # GREEN for other detected objects
-                                        thickness = 2
-                                    
-                                    cv2.rectangle(frame, (int(x1), int(y1)), (int(x2), int(y2)), color, thickness)
-                                    
-                                    # Label with different colors
-                                    label_color = (255, 255, 255) if is_selected else (0, 0, 0)
-                                    cv2.putText(frame, f"{class_name}: {confidence:.2f}", 
-                                              (int(x1), int(y1-10)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, label_color, 2)
-                                
-                                # Store detection with selection flag
-                                detections_data.append({
-                                    'camera_id': camera_id,
-                                    'class': class_name,
-                                    'confidence': float(confidence),
-                                    'is_selected': is_selected,  # Flag to indicate if object should trigger alerts
-                                    'bbox': [int(x1), int(y1), int(x2-x1), int(y2-y1)]
-                                })
-                
-                # Broadcast detection results and save analytics even when no objects detected
-                detection_timestamp = datetime.now().isoformat()
-                
-                if object_counts or True:  # Always process and save analytics
-                    await manager.broadcast(json.dumps({
-                        'type': 'detection',
-                        'camera_id': camera_id,
-                        'detections': detections_data,
-                        'object_counts': object_counts,
-                        'timestamp': detection_timestamp,
-                        'settings': {
-                            'enabled_objects': cam_settings.get('enabled_objects', []),
-                            'play_sound_alerts': cam_settings.get('play_sound_alerts', True),
-                            'detection_threshold': cam_settings.get('detection_threshold', 0.5)
-                        }
-                    }))
-                    
-                    # Save analytics to database
+                if pending_detection is not None and pending_detection.done():
                     try:
-                        if db:
-                            # Get camera user_id for analytics
-                            camera_doc = await db.collection('cameras').document(camera_id).get()
-                            user_id = None
-                            if camera_doc.exists:
-                                user_id = camera_doc.to_dict().get('user_id')
+                        # Boxes come back as arrays, copied off the device once per frame
+                        xyxy, confidences, class_ids = pending_detection.result()
+                    except Exception as e:
+                        logger.error(f"Error detecting objects for camera {camera_id}: {e}")
+                        overlay = None
+                    else:
+                        # The batch may have been filtered at another camera's lower threshold
+                        xyxy, confidences, class_ids, counts = postprocess_boxes(
+                            xyxy, confidences, class_ids, threshold, len(CLASS_NAMES)
+                        )
+                        
+                        # Process detections - DETECT ALL OBJECTS
+                        present = np.flatnonzero(counts)
+                        object_counts = {CLASS_NAMES[class_id]: count for class_id, count in zip(present.tolist(), counts[present].tolist())}
+                        class_names = [CLASS_NAMES[class_id] for class_id in class_ids.tolist()]
+                        
+                        # Check if each object is in the selected list
+                        selected = np.array([len(enabled_objects) == 0 or class_name in enabled_objects for class_name in class_names], dtype=bool)
+                        
+                        labels = []
+                        detections_data = []
+                        for (x1, y1, x2, y2), confidence, class_name, is_selected in zip(xyxy.tolist(), confidences.tolist(), class_names, selected.tolist()):
+                            # Label with different colors
+                            label_color = (255, 255, 255) if is_selected else (0, 0, 0)
+                            labels.append((f"{class_name}: {confidence:.2f}", (x1, y1-10), label_color))
                             
-                            # Save regular analytics with user_id
-                            analytics_data = {
+                            # Store detection with selection flag
+                            detections_data.append({
                                 'camera_id': camera_id,
-                                'user_id': user_id,  # Add user_id for isolation
-                                'object_counts': object_counts,
-                                'timestamp': datetime.now().isoformat()
+                                'class': class_name,
+                                'confidence': confidence,
+                                'is_selected': is_selected,  # Flag to indicate if object should trigger alerts
+                                'bbox': [x1, y1, x2-x1, y2-y1]
+                            })
+                        overlay = (xyxy, selected, labels)
+                        
+                        # Broadcast detection results and save analytics even when no objects detected
+                        await manager.broadcast(orjson.dumps({
+                            'type': 'detection',
+                            'camera_id': camera_id,
+                            'detections': detections_data,
+                            'object_counts': object_counts,
+                            'timestamp': datetime.now().isoformat(),
+                            'settings': {
+                                'enabled_objects': cam_settings.get('enabled_objects', []),
+                                'play_sound_alerts': cam_settings.get('play_sound_alerts', True),
+                                'detection_threshold': cam_settings.get('detection_threshold', 0.5)
                             }
-                            await db.collection('analytics').add(analytics_data)
-                            print(f"Saved analytics for camera {camera_id}: {object_counts}")
-                            
-                            # Update hourly analytics with proper aggregation
-                            hour_key = datetime.now().strftime('%Y-%m-%d %H:00')
-                            total_count = sum(object_counts.values())
-                            
-                            # Check if hourly record exists
-                            hourly_ref = db.collection('hourly_analytics')
-                            query = hourly_ref.where('camera_id', '==', camera_id).where('hour_key', '==', hour_key)
-                            existing_docs = [doc async for doc in query.stream()]
-                            
-                            if existing_docs:
-                                # Update existing hourly record
-                                existing_doc = existing_docs[0]
-                                existing_data = existing_doc.to_dict()
-                                existing_counts = existing_data.get('object_counts', {})
-                                existing_total = existing_data.get('total_detections', 0)
-                                
-                                # Merge object counts
-                                for obj_type, count in object_counts.items():
-                                    existing_counts[obj_type] = existing_counts.get(obj_type, 0) + count
-                                
-                                new_total = existing_total + total_count
-                                
-                                await existing_doc.reference.update({
-                                    'object_counts': existing_counts,
-                                    'total_detections': new_total
-                                })
-                                
-                                print(f"Updated hourly analytics for camera {camera_id}, hour {hour_key}: {existing_counts}, total: {new_total}")
-                            else:
-                                # Insert new hourly record with user_id
-                                hourly_data = {
-                                    'camera_id': camera_id,
-                                    'user_id': user_id,  # Add user_id for isolation
-                                    'hour_key': hour_key,
-                                    'object_counts': object_counts,
-                                    'total_detections': total_count,
-                                    'created_at': datetime.now().isoformat()
-                                }
-                                
-                                await db.collection('hourly_analytics').add(hourly_data)
-                                print(f"Created new hourly analytics for camera {camera_id}, hour {hour_key}: {object_counts}, total: {total_count}")
+                        }).decode())
                         
-                    except Exception as db_error:
-                        print(f"Error saving analytics for camera {camera_id}: {db_error}")
-                        print(f"Object counts that failed to save: {object_counts}")
-                        import traceback
-                        traceback.print_exc()
+                        # Accumulate analytics; they are written to the database in periodic batches
+                        analytics_buffer.add(camera_id, user_id, object_counts)
+                    pending_detection = None
+                
+                if pending_detection is None:
+                    # The copy is detected in the background while this frame is drawn on and reused
+                    pending_detection = asyncio.create_task(inference_batcher.submit(frame.copy(), threshold))
+                
+                # Draw bounding boxes if enabled: one polylines call per color draws every box of that color
+                if show_boxes and overlay is not None and len(overlay[0]):
+                    xyxy, selected, labels = overlay
+                    corners = xyxy[:, [0, 1, 2, 1, 2, 3, 0, 3]].reshape(-1, 4, 2)
+                    # RED boxes for SELECTED objects, GREEN for all others
+                    for mask, color, thickness in ((selected, (0, 0, 255), 3), (~selected, (0, 255, 0), 2)):
+                        if mask.any():
+                            cv2.polylines(frame, list(corners[mask]), True, color, thickness)
+                    for label, origin, label_color in labels:
+                        cv2.putText(frame, label, origin, cv2.FONT_HERSHEY_SIMPLEX, 0.5, label_color, 2)
             
             # Encode frame as JPEG
-            _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
-            frame_base64 = base64.b64encode(buffer).decode('utf-8')
+            buffer = await asyncio.get_running_loop().run_in_executor(jpeg_executor, encode_jpeg, frame, 80)
             
-            # Broadcast frame
-            await manager.broadcast(json.dumps({
+            # Broadcast frame as a binary message; the JPEG goes out as-is, without base64
+            await manager.broadcast_bytes(pack_binary_message({
                 'type': 'frame',
                 'camera_id': camera_id,
-                'frame': frame_base64,
                 'timestamp': datetime.now().isoformat()
-            }))
+            }, buffer))
             
             await asyncio.sleep(0.1)  # ~10 FPS
             
     except Exception as e:
-        print(f"Error processing camera {camera_id}: {e}")
+        logger.error(f"Error processing camera {camera_id}: {e}")
     finally:
+        if pending_detection is not None:
+            pending_detection.cancel()
         if 'cap' in locals():
             cap.release()
 
@@ -418,7 +870,7 @@ async def get_cameras(current_user: dict = Depends(get_current_user)):
             )
         return camera_list
     except Exception as e:
-        print(f"Error fetching cameras: {e}")
+        logger.error(f"Error fetching cameras: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch cameras")
 
 @app.post("/cameras", response_model=CameraResponse)
@@ -453,20 +905,21 @@ async def add_camera(camera: Camera, background_tasks: BackgroundTasks, current_
             created_at=datetime.now().isoformat()
         )
     except Exception as e:
-        print(f"Error adding camera: {e}")
+        logger.error(f"Error adding camera: {e}")
         raise HTTPException(status_code=500, detail="Failed to add camera")
 
-def test_camera_connection(ip_address: str, port: int):
+async def test_camera_connection(ip_address: str, port: int):
     """Test camera connection (background task)"""
     try:
         test_url = get_camera_stream_url(ip_address, port)
-        response = requests.get(test_url, timeout=5)
-        if response.status_code == 200:
-            print(f"Camera at {test_url} is reachable")
-        else:
-            print(f"Camera at {test_url} returned status code {response.status_code}")
+        # The stream URL never ends, so only the response headers are read
+        async with services.http_client.stream('GET', test_url) as response:
+            if response.status_code == 200:
+                logger.info(f"Camera at {test_url} is reachable")
+            else:
+                logger.warning(f"Camera at {test_url} returned status code {response.status_code}")
     except Exception as e:
-        print(f"Error testing camera connection: {e}")
+        logger.error(f"Error testing camera connection: {e}")
 
 @app.delete("/cameras/{camera_id}")
 async def delete_camera(camera_id: str, current_user: dict = Depends(get_current_user)):
@@ -494,7 +947,7 @@ async def delete_camera(camera_id: str, current_user: dict = Depends(get_current
         
         return {"message": "Camera deleted successfully"}
     except Exception as e:
-        print(f"Error deleting camera: {e}")
+        logger.error(f"Error deleting camera: {e}")
         raise HTTPException(status_code=500, detail="Failed to delete camera")
 
 @app.post("/cameras/{camera_id}/start")
@@ -515,7 +968,13 @@ async def start_camera(camera_id: str, current_user: dict = Depends(get_current_
             raise HTTPException(status_code=403, detail="Access denied")
         
         if camera_id not in active_cameras:
-            active_cameras[camera_id] = True
+            # The owner never changes while the camera runs, so frames never have to look it up
+            active_cameras[camera_id] = {
+                'active': True,
+                'user_id': camera_data.get('user_id'),
+                'ip_address': camera_data['ip_address'],
+                'port': camera_data['port']
+            }
             # Start camera processing in background
             asyncio.create_task(process_camera_frame(camera_id, camera_data['ip_address'], camera_data['port']))
         
@@ -523,7 +982,7 @@ async def start_camera(camera_id: str, current_user: dict = Depends(get_current_
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error starting camera: {e}")
+        logger.error(f"Error starting camera: {e}")
         raise HTTPException(status_code=500, detail="Failed to start camera")
 
 @app.post("/cameras/{camera_id}/stop")
@@ -604,7 +1063,7 @@ async def update_camera_settings(camera_id: str, settings: CameraSettings, curre
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error updating camera settings: {e}")
+        logger.error(f"Error updating camera settings: {e}")
         raise HTTPException(status_code=500, detail="Failed to update camera settings")
 
 @app.get("/cameras/{camera_id}/settings")
@@ -637,7 +1096,7 @@ async def get_camera_settings(camera_id: str, current_user: dict = Depends(get_c
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error getting camera settings: {e}")
+        logger.error(f"Error getting camera settings: {e}")
         raise HTTPException(status_code=500, detail="Failed to get camera settings")
 
 @app.get("/analytics/{camera_id}")
@@ -656,51 +1115,60 @@ async def get_analytics(camera_id: str, hours: int = 24, current_user: dict = De
         else:
             raise HTTPException(status_code=404, detail="Camera not found")
         
-        print(f"Fetching analytics for camera {camera_id} for last {hours} hours")
+        logger.info(f"Fetching analytics for camera {camera_id} for last {hours} hours")
         
         # Calculate cutoff time
         cutoff_time = datetime.now() - timedelta(hours=hours)
         
-        # Query analytics from Firestore - filter by user_id for isolation
+        # Query analytics from Firestore - filter by user_id for isolation. The time filter and
+        # ordering run server-side on the composite index in firestore.indexes.json.
         analytics_ref = db.collection('analytics')
-        query = analytics_ref.where('camera_id', '==', camera_id).where('user_id', '==', current_user.get('uid')).limit(1000)
-        
-        analytics_docs = query.stream()
+        query = (analytics_ref
+                 .where('camera_id', '==', camera_id)
+                 .where('user_id', '==', current_user.get('uid'))
+                 .where('timestamp', '>=', cutoff_time.isoformat())  # ISO-8601 strings sort chronologically
+                 .order_by('timestamp', direction=Query.DESCENDING)
+                 .limit(1000))
         
         result = []
-        async for doc in analytics_docs:
+        async for doc in query.stream():
             data = doc.to_dict()
-            
-            # Filter by time in application code to avoid index requirement
-            try:
-                record_timestamp = datetime.fromisoformat(data.get('timestamp', ''))
-                if record_timestamp >= cutoff_time:
-                    result.append({
-                        'object_counts': data.get('object_counts', {}),
-                        'timestamp': data.get('timestamp', '')
-                    })
-            except (ValueError, TypeError):
-                # Skip records with invalid timestamps
-                continue
+            result.append({
+                'object_counts': data.get('object_counts', {}),
+                'timestamp': data.get('timestamp', '')
+            })
         
-        print(f"Returning {len(result)} analytics records for camera {camera_id}")
+        logger.info(f"Returning {len(result)} analytics records for camera {camera_id}")
         return result
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error fetching analytics for camera {camera_id}: {e}")
+        logger.error(f"Error fetching analytics for camera {camera_id}: {e}")
         # Fallback: try simple query without ordering if the above fails
         try:
-            print("Attempting fallback query without ordering...")
+            logger.info("Attempting fallback query without ordering...")
             analytics_ref = db.collection('analytics')
-            simple_query = analytics_ref.where('camera_id', '==', camera_id).where('user_id', '==', current_user.get('uid')).limit(500)
-            simple_docs = simple_query.stream()
+            simple_query = analytics_ref.where('camera_id', '==', camera_id).where('user_id', '==', current_user.get('uid'))
+            
+            # Scan the unsharded query and every shard concurrently, splitting the read budget between
+            # them. Records written before sharding have no shard field and Firestore cannot select on a
+            # missing field, so only the unsharded query can return them; it can also return sharded
+            # records, so the results are de-duplicated by document id.
+            shard_limit = ANALYTICS_FALLBACK_LIMIT // (2 * ANALYTICS_SHARDS)
+            scans = await asyncio.gather(
+                simple_query.limit(ANALYTICS_FALLBACK_LIMIT // 2).get(),
+                *[simple_query.where('shard', '==', shard).limit(shard_limit).get() for shard in range(ANALYTICS_SHARDS)]
+            )
             
             result = []
+            seen = set()
             cutoff_time = datetime.now() - timedelta(hours=hours)
             
-            async for doc in simple_docs:
+            for doc in (doc for docs in scans for doc in docs):
+                if doc.id in seen:
+                    continue
+                seen.add(doc.id)
                 data = doc.to_dict()
                 try:
                     record_timestamp = datetime.fromisoformat(data.get('timestamp', ''))
@@ -711,12 +1179,13 @@ async def get_analytics(camera_id: str, hours: int = 24, current_user: dict = De
                         })
                 except (ValueError, TypeError):
                     continue
+            result.sort(key=lambda x: x['timestamp'], reverse=True)
             
-            print(f"Fallback query returned {len(result)} analytics records")
+            logger.info(f"Fallback query returned {len(result)} analytics records")
             return result
             
         except Exception as fallback_error:
-            print(f"Fallback query also failed: {fallback_error}")
+            logger.error(f"Fallback query also failed: {fallback_error}")
             return []
 
 @app.get("/analytics/{camera_id}/hourly")
@@ -735,42 +1204,38 @@ async def get_hourly_analytics(camera_id: str, hours: int = 24, current_user: di
         else:
             raise HTTPException(status_code=404, detail="Camera not found")
         
-        print(f"Fetching hourly analytics for camera {camera_id} for last {hours} hours")
+        logger.info(f"Fetching hourly analytics for camera {camera_id} for last {hours} hours")
         
         # Calculate cutoff time
         cutoff_time = datetime.now() - timedelta(hours=hours)
         
-        # Query hourly analytics from Firestore - filter by user_id for isolation
+        # Query hourly analytics from Firestore - filter by user_id for isolation. The time filter
+        # and ordering run server-side on the composite index in firestore.indexes.json.
         hourly_ref = db.collection('hourly_analytics')
-        query = hourly_ref.where('camera_id', '==', camera_id).where('user_id', '==', current_user.get('uid')).limit(200)
-        
-        hourly_docs = query.stream()
+        query = (hourly_ref
+                 .where('camera_id', '==', camera_id)
+                 .where('user_id', '==', current_user.get('uid'))
+                 .where('hour_key', '>=', cutoff_time.strftime('%Y-%m-%d %H:00'))
+                 .order_by('hour_key', direction=Query.DESCENDING)
+                 .limit(200))
         
         result = []
-        async for doc in hourly_docs:
+        async for doc in query.stream():
             data = doc.to_dict()
-            
-            # Filter by time in application code to avoid index requirement
-            try:
-                record_timestamp = datetime.fromisoformat(data.get('created_at', ''))
-                if record_timestamp >= cutoff_time:
-                    result.append({
-                        'hour': data.get('hour_key', ''),
-                        'object_counts': data.get('object_counts', {}),
-                        'total': data.get('total_detections', 0)
-                    })
-            except (ValueError, TypeError):
-                # Skip records with invalid timestamps
-                continue
+            result.append({
+                'hour': data.get('hour_key', ''),
+                'object_counts': data.get('object_counts', {}),
+                'total': data.get('total_detections', 0)
+            })
         
-        print(f"Returning {len(result)} hourly analytics records for camera {camera_id}")
+        logger.info(f"Returning {len(result)} hourly analytics records for camera {camera_id}")
         return result
         
     except Exception as e:
-        print(f"Error fetching hourly analytics for camera {camera_id}: {e}")
+        logger.error(f"Error fetching hourly analytics for camera {camera_id}: {e}")
         # Fallback: try simple query without time filtering
         try:
-            print("Attempting fallback hourly query...")
+            logger.info("Attempting fallback hourly query...")
             hourly_ref = db.collection('hourly_analytics')
             simple_query = hourly_ref.where('camera_id', '==', camera_id).limit(100)
             simple_docs = simple_query.stream()
@@ -784,11 +1249,11 @@ async def get_hourly_analytics(camera_id: str, hours: int = 24, current_user: di
                     'total': data.get('total_detections', 0)
                 })
             
-            print(f"Fallback hourly query returned {len(result)} records")
+            logger.info(f"Fallback hourly query returned {len(result)} records")
             return result
             
         except Exception as fallback_error:
-            print(f"Fallback hourly query also failed: {fallback_error}")
+            logger.error(f"Fallback hourly query also failed: {fallback_error}")
             return []
 
 # WebSocket endpoint
@@ -799,10 +1264,10 @@ async def websocket_endpoint(websocket: WebSocket):
     try:
         while True:
             data = await websocket.receive_text()
-            message = json.loads(data)
+            message = orjson.loads(data)
             
             if message.get('type') == 'ping':
-                await websocket.send_text(json.dumps({'type': 'pong'}))
+                await manager.send_personal_message(orjson.dumps({'type': 'pong'}).decode(), websocket)
     except WebSocketDisconnect:
         manager.disconnect(websocket)
 
@@ -813,21 +1278,19 @@ async def debug_database(camera_id: str):
         return {'error': 'Database not initialized'}
     
     try:
-        # Count analytics records
-        analytics_ref = db.collection('analytics')
-        analytics_query = analytics_ref.where('camera_id', '==', camera_id)
-        analytics_docs = [doc async for doc in analytics_query.stream()]
-        analytics_count = len(analytics_docs)
+        analytics_query = db.collection('analytics').where('camera_id', '==', camera_id)
+        hourly_query = db.collection('hourly_analytics').where('camera_id', '==', camera_id)
         
-        # Count hourly analytics records
-        hourly_ref = db.collection('hourly_analytics')
-        hourly_query = hourly_ref.where('camera_id', '==', camera_id)
-        hourly_docs = [doc async for doc in hourly_query.stream()]
-        hourly_count = len(hourly_docs)
-        
-        # Get recent records
-        recent_analytics = analytics_docs[:5] if analytics_docs else []
-        recent_hourly = hourly_docs[:5] if hourly_docs else []
+        # Count records with server-side aggregations (no documents transferred) and fetch
+        # a few recent records, all concurrently
+        analytics_count, hourly_count, recent_analytics, recent_hourly = await asyncio.gather(
+            analytics_query.count().get(),
+            hourly_query.count().get(),
+            analytics_query.limit(5).get(),
+            hourly_query.limit(5).get()
+        )
+        analytics_count = analytics_count[0][0].value
+        hourly_count = hourly_count[0][0].value
         
         return {
             'camera_id': camera_id,
@@ -837,9 +1300,24 @@ async def debug_database(camera_id: str):
             'recent_hourly': [doc.to_dict() for doc in recent_hourly]
         }
     except Exception as e:
-        print(f"Error in debug endpoint: {e}")
+        logger.error(f"Error in debug endpoint: {e}")
         return {'error': str(e)}
 
+# Most records read to find the latest ones when the timestamp index is missing
+ANALYTICS_SCAN_LIMIT = 500
+
+async def fetch_latest_analytics(query, limit: int) -> List[Dict]:
+    """Return the newest `limit` analytics records matching a camera query"""
+    try:
+        analytics_docs = await query.order_by('timestamp', direction=Query.DESCENDING).limit(limit).get()
+        return [doc.to_dict() for doc in analytics_docs]
+    except FailedPrecondition as index_error:
+        # Without the composite index, sort in application code instead
+        logger.warning(f"Ordered analytics query failed, sorting in application code: {index_error}")
+        records = [doc.to_dict() for doc in await query.limit(ANALYTICS_SCAN_LIMIT).get()]
+        records.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
+        return records[:limit]
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat_with_assistant(message: ChatMessage, current_user: dict = Depends(get_current_user)):
     """Chat with LLM assistant about camera analytics"""
@@ -858,45 +1336,43 @@ async def chat_with_assistant(message: ChatMessage, current_user: dict = Depends
         )
 
     try:
-        print(f"Processing chat message: {message.message[:50]}...")
+        logger.info(f"Processing chat message: {message.message[:50]}...")
 
         # Get analytics data for context
         context_data = "No analytics data available yet."
+        # The numbers the answer is based on (totals and object types); None when the context could not be loaded
+        analytics_summary = ('empty',)
 
         try:
             if message.camera_id:
                 # Get specific camera analytics with error handling
-                print(f"Fetching analytics for camera: {message.camera_id}")
-                analytics_ref = db.collection('analytics')
-                query = analytics_ref.where('camera_id', '==', message.camera_id).limit(10)
-                analytics_docs = query.stream()
-
-                camera_analytics = []
-                async for doc in analytics_docs:
-                    camera_analytics.append(doc.to_dict())
+                logger.info(f"Fetching analytics for camera: {message.camera_id}")
+                analytics_query = db.collection('analytics').where('camera_id', '==', message.camera_id)
+                # Count every record server-side and fetch only the latest few to summarize
+                record_count, camera_analytics = await asyncio.gather(
+                    analytics_query.count().get(),
+                    fetch_latest_analytics(analytics_query, 10)
+                )
+                record_count = record_count[0][0].value
 
                 if camera_analytics:
-                    # Create structured context data
-                    total_detections = sum(
-                        sum(record.get('object_counts', {}).values()) 
-                        for record in camera_analytics
-                    )
-                    
-                    # Aggregate object counts
-                    aggregated_objects = {}
+                    # Create structured context data: aggregate object counts
+                    aggregated_objects = Counter()
                     for record in camera_analytics:
-                        for obj_type, count in record.get('object_counts', {}).items():
-                            aggregated_objects[obj_type] = aggregated_objects.get(obj_type, 0) + count
+                        aggregated_objects.update(record.get('object_counts') or {})
+                    total_detections = sum(aggregated_objects.values())
                     
                     # Sort objects by count
-                    sorted_objects = sorted(aggregated_objects.items(), key=lambda x: x[1], reverse=True)
+                    sorted_objects = aggregated_objects.most_common(5)
+                    activity = 'High' if total_detections > 20 else 'Moderate' if total_detections > 5 else 'Low'
+                    analytics_summary = (total_detections, tuple(sorted(aggregated_objects)))
                     
                     context_data = f"""Camera {message.camera_id} Analytics:
-• Detection Records: {len(camera_analytics)} recent entries
+• Detection Records: {record_count} entries ({len(camera_analytics)} most recent summarized)
 • Total Objects Detected: {total_detections}
-• Object Types Found: {', '.join([f"{obj}: {count}" for obj, count in sorted_objects[:5]])}
+• Object Types Found: {', '.join([f"{obj}: {count}" for obj, count in sorted_objects])}
 • Most Common Object: {sorted_objects[0][0] if sorted_objects else 'None'} ({sorted_objects[0][1] if sorted_objects else 0} detections)
-• Detection Activity: {'High' if total_detections > 20 else 'Moderate' if total_detections > 5 else 'Low'}"""
+• Detection Activity: {activity}"""
                 else:
                     context_data = f"""Camera {message.camera_id} Status:
 • Detection Records: 0 (No data yet)
@@ -904,37 +1380,35 @@ async def chat_with_assistant(message: ChatMessage, current_user: dict = Depends
 • Recommendation: Start camera streaming and enable object detection"""
             else:
                 # Get general analytics summary
-                print("Fetching general analytics summary")
+                logger.info("Fetching general analytics summary")
                 analytics_ref = db.collection('analytics')
-                query = analytics_ref.limit(20)
-                analytics_docs = query.stream()
-
-                general_analytics = []
-                async for doc in analytics_docs:
-                    general_analytics.append(doc.to_dict())
+                record_count, analytics_docs = await asyncio.gather(
+                    analytics_ref.count().get(),
+                    analytics_ref.order_by('timestamp', direction=Query.DESCENDING).limit(20).get()
+                )
+                record_count = record_count[0][0].value
+                general_analytics = [doc.to_dict() for doc in analytics_docs]
 
                 if general_analytics:
                     # Create structured system-wide context
-                    total_detections = sum(
-                        sum(record.get('object_counts', {}).values()) 
-                        for record in general_analytics
-                    )
                     camera_ids = set(record.get('camera_id') for record in general_analytics if record.get('camera_id'))
                     
                     # Aggregate all object types across cameras
-                    all_objects = {}
+                    all_objects = Counter()
                     for record in general_analytics:
-                        for obj_type, count in record.get('object_counts', {}).items():
-                            all_objects[obj_type] = all_objects.get(obj_type, 0) + count
+                        all_objects.update(record.get('object_counts') or {})
+                    total_detections = sum(all_objects.values())
                     
-                    sorted_all_objects = sorted(all_objects.items(), key=lambda x: x[1], reverse=True)
+                    sorted_all_objects = all_objects.most_common(3)
+                    activity = 'Very High' if total_detections > 50 else 'High' if total_detections > 20 else 'Moderate'
+                    analytics_summary = (len(camera_ids), total_detections, tuple(sorted(all_objects)))
                     
                     context_data = f"""System-Wide Analytics Summary:
 • Active Cameras: {len(camera_ids)} cameras
-• Detection Records: {len(general_analytics)} recent entries  
+• Detection Records: {record_count} entries ({len(general_analytics)} most recent summarized)
 • Total Objects Detected: {total_detections}
-• Top Object Types: {', '.join([f"{obj}: {count}" for obj, count in sorted_all_objects[:3]])}
-• System Activity: {'Very High' if total_detections > 50 else 'High' if total_detections > 20 else 'Moderate'}"""
+• Top Object Types: {', '.join([f"{obj}: {count}" for obj, count in sorted_all_objects])}
+• System Activity: {activity}"""
                 else:
                     context_data = """System Status:
 • Detection Records: 0 (No data available)
@@ -943,54 +1417,39 @@ async def chat_with_assistant(message: ChatMessage, current_user: dict = Depends
 • Next Steps: Add cameras and start detection to begin analytics"""
 
         except Exception as context_error:
-            print(f"Error fetching context data: {context_error}")
+            logger.error(f"Error fetching context data: {context_error}")
+            analytics_summary = None
             context_data = """System Status:
 • Analytics Data: ⚠️ Temporarily unavailable
 • Issue: Database connection error
 • Action: Please try again in a moment"""
 
-        # Create prompt with context for beautiful formatted responses
-        prompt = f"""You are an AI assistant for a YOLO object detection system. Help users analyze their camera analytics data.
+        # Answers quote the totals, so a cached answer is only reused while they are unchanged
+        cache_key = None
+        if analytics_summary is not None:
+            cache_key = (current_user.get('uid'), message.camera_id or '*', message.message.strip().lower(), analytics_summary)
+        ai_response = CHAT_RESPONSE_CACHE.get(cache_key) if cache_key else None
 
-Context information:
-{context_data}
-
-User question: {message.message}
-
-IMPORTANT FORMATTING GUIDELINES:
-- Use clear structure with bullet points (•) and numbered lists
-- Include relevant emojis for visual appeal
-- Use line breaks for better readability
-- Highlight key numbers and insights with **bold** formatting
-- Use sections like "📊 Summary:", "🔍 Details:", "💡 Insights:" when appropriate
-- Keep responses under 200 words but well-organized
-- Use markdown-style formatting that will display nicely in chat
-
-Example format:
-📊 **Detection Summary:**
-• Total objects detected: **24**
-• Most common: **chair** (8 detections)
-• Activity level: **High**
-
-🎯 **Key Insights:**
-• Peak detection time: Morning hours
-• Detection accuracy: 95%
-
-💡 **Recommendations:**
-• Consider adjusting sensitivity for better results
-
-Provide a helpful, beautifully formatted response based on the available analytics data."""
-
-        print("Generating AI response...")
-        # Generate response using Gemini with error handling
-        try:
-            response = gemini_client.models.generate_content(
-                model="gemini-2.5-flash", contents=prompt
-            )
-            ai_response = response.text if response.text else "I'm sorry, I couldn't generate a response. Please try again."
-        except Exception as ai_error:
-            print(f"Error generating AI response: {ai_error}")
-            ai_response = f"I'm sorry, I encountered an error while processing your question: '{message.message}'. The AI service might be temporarily unavailable. Please try again later."
+        if ai_response is not None:
+            logger.info("Using cached AI response")
+        else:
+            logger.info("Generating AI response...")
+            # Generate response using Gemini with error handling
+            try:
+                context_header, question_header = DYNAMIC_TAIL_PARTS
+                response = gemini_client.models.generate_content(
+                    model=GEMINI_MODEL,
+                    contents=''.join((STATIC_PREAMBLE, context_header, context_data, question_header, message.message))
+                )
+                if response.text:
+                    ai_response = response.text
+                    if cache_key:
+                        CHAT_RESPONSE_CACHE[cache_key] = ai_response
+                else:
+                    ai_response = "I'm sorry, I couldn't generate a response. Please try again."
+            except Exception as ai_error:
+                logger.error(f"Error generating AI response: {ai_error}")
+                ai_response = f"I'm sorry, I encountered an error while processing your question: '{message.message}'. The AI service might be temporarily unavailable. Please try again later."
 
         # Save chat history with error handling
         try:
@@ -1003,9 +1462,9 @@ Provide a helpful, beautifully formatted response based on the available analyti
             }
 
             await db.collection('chat_history').add(chat_record)
-            print("Chat history saved successfully")
+            logger.info("Chat history saved successfully")
         except Exception as save_error:
-            print(f"Error saving chat history: {save_error}")
+            logger.error(f"Error saving chat history: {save_error}")
             # Don't fail the request if saving history fails
 
         return ChatResponse(
@@ -1014,9 +1473,7 @@ Provide a helpful, beautifully formatted response based on the available analyti
         )
 
     except Exception as e:
-        print(f"Error in chat assistant: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Error in chat assistant: {e}")
 
         # Return a friendly error message instead of HTTP exception
         return ChatResponse(
@@ -1025,6 +1482,20 @@ Provide a helpful, beautifully formatted response based on the available analyti
         )
 
 
+async def fetch_chat_history(camera_id: str, user_id: Optional[str], limit: int = 50) -> List[Dict]:
+    """Query Firestore for a user's chat history on one camera, newest first"""
+    chat_ref = db.collection('chat_history')
+    query = chat_ref.where('camera_id', '==', camera_id).where('user_id', '==', user_id)
+    try:
+        chat_docs = await query.order_by('timestamp', direction=Query.DESCENDING).limit(limit).get()
+        return [doc.to_dict() for doc in chat_docs]
+    except Exception as order_error:
+        # Without the composite index, sort in application code instead
+        logger.warning(f"Ordered chat history query failed, sorting in application code: {order_error}")
+        chat_history = [doc.to_dict() for doc in await query.limit(limit).get()]
+        chat_history.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
+        return chat_history
+
 @app.get("/chat/history/{camera_id}")
 async def get_chat_history(camera_id: str, current_user: dict = Depends(get_current_user)):
     """Retrieve chat history for a specific camera"""
@@ -1032,35 +1503,34 @@ async def get_chat_history(camera_id: str, current_user: dict = Depends(get_curr
         raise HTTPException(status_code=500, detail="Database not initialized")
     
     try:
-        # Verify camera ownership
-        camera_doc = await db.collection('cameras').document(camera_id).get()
-        if camera_doc.exists:
-            camera_data = camera_doc.to_dict()
-            if camera_data.get('user_id') != current_user.get('uid'):
-                raise HTTPException(status_code=403, detail="Access denied")
-        else:
-            raise HTTPException(status_code=404, detail="Camera not found")
-        
-        print(f"Fetching chat history for camera: {camera_id}")
-        
-        # Query Firestore for chat history filtered by user
-        chat_ref = db.collection('chat_history')
-        query = chat_ref.where('camera_id', '==', camera_id).where('user_id', '==', current_user.get('uid')).limit(50)
-        chat_docs = query.stream()
+        logger.info(f"Fetching chat history for camera: {camera_id}")
         
-        chat_history = []
-        async for doc in chat_docs:
-            chat_history.append(doc.to_dict())
+        # The ownership check and the history query are independent, so run both round trips at once
+        history_task = asyncio.create_task(fetch_chat_history(camera_id, current_user.get('uid')))
+        try:
+            # Verify camera ownership
+            camera_doc = await db.collection('cameras').document(camera_id).get()
+            if camera_doc.exists:
+                camera_data = camera_doc.to_dict()
+                if camera_data.get('user_id') != current_user.get('uid'):
+                    raise HTTPException(status_code=403, detail="Access denied")
+            else:
+                raise HTTPException(status_code=404, detail="Camera not found")
+        except BaseException:
+            history_task.cancel()
+            # Retrieve the task's outcome so a query that already failed is not reported as never retrieved
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await history_task
+            raise
         
-        # Sort by timestamp descending in application code
-        chat_history.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
+        chat_history = await history_task
         
-        print(f"Retrieved {len(chat_history)} chat history records for camera {camera_id}")
+        logger.info(f"Retrieved {len(chat_history)} chat history records for camera {camera_id}")
         return chat_history
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error fetching chat history for camera {camera_id}: {e}")
+        logger.error(f"Error fetching chat history for camera {camera_id}: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch chat history")
     
 @app.delete("/chat/history/{camera_id}")
@@ -1070,21 +1540,30 @@ async def clear_chat_history(camera_id: str, current_user: dict = Depends(get_cu
         raise HTTPException(status_code=500, detail="Database not initialized")
     
     try:
-        print(f"Clearing chat history for camera: {camera_id}")
+        logger.info(f"Clearing chat history for camera: {camera_id}")
         
         # Query Firestore for chat history
         chat_ref = db.collection('chat_history')
         query = chat_ref.where('camera_id', '==', camera_id)
         chat_docs = query.stream()
         
-        # Delete each document
+        # Delete in batches (Firestore allows up to 500 writes per batch)
+        batch = db.batch()
+        pending = 0
         async for doc in chat_docs:
-            await doc.reference.delete()
+            batch.delete(doc.reference)
+            pending += 1
+            if pending == 400:
+                await batch.commit()
+                batch = db.batch()
+                pending = 0
+        if pending:
+            await batch.commit()
         
-        print(f"Chat history cleared for camera {camera_id}")
+        logger.info(f"Chat history cleared for camera {camera_id}")
         return {"message": f"Chat history cleared for camera {camera_id}"}
     except Exception as e:
-        print(f"Error clearing chat history for camera {camera_id}: {e}")
+        logger.error(f"Error clearing chat history for camera {camera_id}: {e}")
         raise HTTPException(status_code=500, detail="Failed to clear chat history")    
 
 @app.get("/health")
@@ -1104,6 +1583,32 @@ async def health_check():
         }
     }
 
-if __name__ == "__main__":
+@app.on_event("shutdown")
+async def flush_pending_analytics():
+    """Write analytics still buffered in memory before the server exits"""
+    await analytics_buffer.flush()
+
+@app.on_event("shutdown")
+async def close_http_client():
+    await services.http_client.aclose()
+
+@app.on_event("startup")
+async def start_inference():
+    """Create the inference process and its shared frame buffer in the serving process only"""
+    inference_backend.open()
+
+@app.on_event("shutdown")
+async def stop_inference():
+    """Stop the inference worker and release its shared frame buffer"""
+    inference_backend.close()
+
+def run_server(app: FastAPI):
+    """Serve an app with uvloop and httptools; shared by the `python main.py` and `python enhanced_main.py` entrypoints"""
+    import importlib.util
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # uvloop ships with uvicorn[standard] on Linux/macOS; Windows has no uvloop build
+    event_loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop=event_loop, http="httptools", ws="websockets")
+
+if __name__ == "__main__":
+    run_server(app)
\ No newline at end of file
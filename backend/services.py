@@ -1,22 +1,201 @@
 import cv2
+import httpx
 import numpy as np
 from ultralytics import YOLO
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, List, Set, Tuple, Optional, Union
 import json
 import asyncio
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache
+import logging
+from log_queue import configure_logging
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+# Frames are small (640x480) and every camera already runs concurrently, so OpenCV's
+# internal thread pool only adds dispatch overhead and oversubscribes the cores
+cv2.setNumThreads(1)
+cv2.ocl.setUseOpenCL(False)
+
+# Optional CPU core for the inference thread (Linux only), keeping it clear of OpenCV work
+INFERENCE_CPU = os.getenv("INFERENCE_CPU")
+
+def _pin_inference_thread():
+    """ThreadPoolExecutor initializer that pins the worker to INFERENCE_CPU"""
+    if INFERENCE_CPU is None or not hasattr(os, 'sched_setaffinity'):
+        return
+    try:
+        os.sched_setaffinity(0, {int(INFERENCE_CPU)})  # pid 0 = the calling thread
+        logger.info(f"Inference thread pinned to CPU {INFERENCE_CPU}")
+    except (ValueError, OSError) as e:
+        logger.warning(f"Could not pin inference thread to CPU {INFERENCE_CPU}: {e}")
+
+# Inference backend: "pytorch" (default), "tensorrt" (requires CUDA + TensorRT)
+# or "openvino" (OpenVINO IR, fastest on Intel CPUs)
+YOLO_BACKEND = os.getenv("YOLO_BACKEND", "pytorch").lower()
+
+# Frames are resized to 640x480 before detection, so engines are built for that shape
+INFERENCE_IMGSZ = (480, 640)
+INFERENCE_MAX_BATCH = 8
+
+# Compile the PyTorch model for the fixed inference shape (first call is slow while compiling)
+YOLO_TORCH_COMPILE = os.getenv("YOLO_TORCH_COMPILE", "false").lower() == "true"
+
+# Hardware decode: IP Webcam serves MJPEG over HTTP, decoded with NVDEC and scaled on the GPU.
+# The default targets Jetson (nvv4l2decoder/nvvidconv); override for other GStreamer setups.
+HW_VIDEO_DECODE = os.getenv("HW_VIDEO_DECODE", "true").lower() == "true"
+GST_CAMERA_PIPELINE = os.getenv(
+    "GST_CAMERA_PIPELINE",
+    "souphttpsrc location={url} is-live=true do-timestamp=true ! multipartdemux ! jpegparse ! "
+    "nvv4l2decoder mjpeg=1 ! nvvidconv ! video/x-raw,format=BGRx,width={width},height={height} ! "
+    "videoconvert ! video/x-raw,format=BGR ! appsink drop=1 max-buffers=1 sync=false"
+)
+GSTREAMER_AVAILABLE = re.search(r'GStreamer:\s+YES', cv2.getBuildInformation()) is not None
+
+# Keep frames on the GPU from inference through JPEG encoding (requires CUDA and JPEG_ENCODER=nvjpeg)
+GPU_FRAME_PIPELINE = os.getenv("GPU_FRAME_PIPELINE", "false").lower() == "true"
+
+# JPEG encoder for streamed frames: "turbojpeg" (default, falls back to OpenCV when
+# libjpeg-turbo is missing), "opencv", or "nvjpeg" (GPU, requires CUDA torchvision)
+JPEG_ENCODER = os.getenv("JPEG_ENCODER", "turbojpeg").lower()
+
+# Shared async HTTP client for camera checks: keeps connections alive between requests
+# and does not block the event loop
+http_client = httpx.AsyncClient(timeout=5.0, limits=httpx.Limits(max_keepalive_connections=32))
+
+def export_tensorrt_engine(model_name: str) -> Optional[str]:
+    """Build a TensorRT FP16 engine next to the weights if it does not exist yet"""
+    engine_path = os.path.splitext(model_name)[0] + '.engine'
+    if os.path.exists(engine_path):
+        return engine_path
+    
+    try:
+        import torch
+        if not torch.cuda.is_available():
+            logger.warning("TensorRT backend requested but CUDA is not available")
+            return None
+        
+        logger.info(f"Exporting {model_name} to TensorRT engine (this can take a few minutes)...")
+        # dynamic=True only makes the batch dimension dynamic (1..batch); height/width stay fixed
+        return YOLO(model_name).export(format='engine', imgsz=INFERENCE_IMGSZ, half=True,
+                                       dynamic=True, batch=INFERENCE_MAX_BATCH, workspace=4)
+    except Exception as e:
+        logger.error(f"Error exporting TensorRT engine: {e}")
+        return None
+
+def export_openvino_model(model_name: str) -> Optional[str]:
+    """Export an OpenVINO IR with FP16 weights next to the weights if it does not exist yet"""
+    model_dir = os.path.splitext(model_name)[0] + '_openvino_model'
+    if os.path.isdir(model_dir):
+        return model_dir
+    
+    try:
+        logger.info(f"Exporting {model_name} to OpenVINO IR...")
+        # dynamic=True keeps the batch dimension open for batched inference
+        return YOLO(model_name).export(format='openvino', imgsz=INFERENCE_IMGSZ, half=True, dynamic=True)
+    except Exception as e:
+        logger.error(f"Error exporting OpenVINO model: {e}")
+        return None
+
+# Box colors, cycled over the class ids
+CLASS_COLORS = [
+    (255, 0, 0),    # Red
+    (0, 255, 0),    # Green
+    (0, 0, 255),    # Blue
+    (255, 255, 0),  # Yellow
+    (255, 0, 255),  # Magenta
+    (0, 255, 255),  # Cyan
+    (128, 0, 128),  # Purple
+    (255, 165, 0),  # Orange
+    (255, 192, 203), # Pink
+    (0, 128, 0),    # Dark Green
+]
+NUM_COCO_CLASSES = 80
+
+# Box labels: OpenCV's text height depends only on font, scale and thickness, so it is measured
+# once; widths are cached per label string (two-decimal confidences repeat constantly)
+LABEL_FONT = cv2.FONT_HERSHEY_SIMPLEX
+LABEL_HEIGHT = cv2.getTextSize('Ag', LABEL_FONT, 0.5, 2)[0][1]
+
+@lru_cache(maxsize=512)
+def _label_width(label: str) -> int:
+    return cv2.getTextSize(label, LABEL_FONT, 0.5, 2)[0][0]
 
 class ObjectDetector:
-    def __init__(self, model_name: str = 'yolov8n.pt'):
+    def __init__(self, model_name: str = 'yolov8n.pt', backend: str = YOLO_BACKEND):
         """Initialize YOLO object detector"""
+        self._infer_kwargs = {'verbose': False}
+        # One color row per class id, so picking a box color is a single array lookup
+        self._color_lut = np.array([CLASS_COLORS[class_id % len(CLASS_COLORS)] for class_id in range(NUM_COCO_CLASSES)],
+                                   dtype=np.uint8)
         try:
-            self.model = YOLO(model_name)
+            if backend == 'tensorrt':
+                engine_path = export_tensorrt_engine(model_name)
+                if engine_path:
+                    model_name = engine_path
+                    # The engine only accepts the shape it was built for
+                    self._infer_kwargs.update(imgsz=INFERENCE_IMGSZ, half=True, device=0)
+                else:
+                    logger.warning(f"Falling back to PyTorch weights {model_name}")
+            elif backend == 'openvino':
+                model_dir = export_openvino_model(model_name)
+                if model_dir:
+                    model_name = model_dir
+                    self._infer_kwargs.update(imgsz=INFERENCE_IMGSZ)
+                else:
+                    logger.warning(f"Falling back to PyTorch weights {model_name}")
+            
+            self.model = YOLO(model_name, task='detect')
+            self._names = self.model.names
             self.loaded = True
-            print(f"YOLO model {model_name} loaded successfully")
+            logger.info(f"YOLO model {model_name} loaded successfully")
         except Exception as e:
-            print(f"Error loading YOLO model: {e}")
+            logger.error(f"Error loading YOLO model: {e}")
             self.loaded = False
             self.model = None
+            return
+        
+        if model_name.endswith('.pt'):
+            self._configure_pytorch()
+            if YOLO_TORCH_COMPILE:
+                self._compile_for_fixed_shape()
+    
+    def _configure_pytorch(self):
+        """Fuse Conv+BN layers and run FP16 at the fixed input shape on CUDA"""
+        self._infer_kwargs.update(imgsz=INFERENCE_IMGSZ)
+        try:
+            import torch
+            self.model.fuse()
+            if torch.cuda.is_available():
+                self._infer_kwargs.update(half=True, device=0)
+                logger.info("YOLO model will run in FP16 on CUDA")
+        except Exception as e:
+            logger.warning(f"Could not configure PyTorch model for FP16: {e}")
+    
+    def _compile_for_fixed_shape(self):
+        """torch.compile the network and warm it up at the one input shape it will see"""
+        try:
+            import torch
+            if not torch.cuda.is_available():
+                logger.warning("Skipping torch.compile: CUDA is not available")
+                return
+            
+            self.model.model = torch.compile(self.model.model, mode='reduce-overhead')
+            self._infer_kwargs.update(imgsz=INFERENCE_IMGSZ, device=0)
+            
+            # Trigger compilation now rather than on the first camera frame
+            dummy_frame = np.zeros((INFERENCE_IMGSZ[0], INFERENCE_IMGSZ[1], 3), dtype=np.uint8)
+            self.model(dummy_frame, **self._infer_kwargs)
+            logger.info(f"YOLO model compiled for input shape {INFERENCE_IMGSZ}")
+        except Exception as e:
+            logger.warning(f"torch.compile failed, using eager model: {e}")
     
     def detect_objects(self, frame: np.ndarray, confidence_threshold: float = 0.5) -> Dict:
         """
@@ -30,106 +209,499 @@ class ObjectDetector:
             Dictionary containing detections and annotated frame
         """
         if not self.loaded:
-            return {
-                'detections': [],
-                'object_counts': {},
-                'annotated_frame': frame
-            }
+            return self._empty_result(frame)
         
         try:
             # Run inference
-            results = self.model(frame)
-            
-            detections = []
-            object_counts = {}
-            annotated_frame = frame.copy()
-            
-            # Process results
-            for result in results:
-                boxes = result.boxes
-                if boxes is not None:
-                    for box in boxes:
-                        # Extract detection data
-                        x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                        confidence = float(box.conf[0].cpu().numpy())
-                        class_id = int(box.cls[0].cpu().numpy())
-                        class_name = self.model.names[class_id]
-                        
-                        if confidence >= confidence_threshold:
-                            # Create detection record
-                            detection = {
-                                'class_name': class_name,
-                                'confidence': confidence,
-                                'bbox': {
-                                    'x1': int(x1),
-                                    'y1': int(y1),
-                                    'x2': int(x2),
-                                    'y2': int(y2),
-                                    'width': int(x2 - x1),
-                                    'height': int(y2 - y1)
-                                }
-                            }
-                            detections.append(detection)
-                            
-                            # Count objects
-                            object_counts[class_name] = object_counts.get(class_name, 0) + 1
-                            
-                            # Draw bounding box
-                            color = self._get_class_color(class_id)
-                            cv2.rectangle(annotated_frame, 
-                                        (int(x1), int(y1)), 
-                                        (int(x2), int(y2)), 
-                                        color, 2)
-                            
-                            # Draw label
-                            label = f"{class_name}: {confidence:.2f}"
-                            label_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 2)[0]
-                            
-                            # Background rectangle for label
-                            cv2.rectangle(annotated_frame,
-                                        (int(x1), int(y1) - label_size[1] - 10),
-                                        (int(x1) + label_size[0], int(y1)),
-                                        color, -1)
-                            
-                            # Label text
-                            cv2.putText(annotated_frame, label,
-                                      (int(x1), int(y1) - 5),
-                                      cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2)
+            results = self.model(frame, **self._infer_kwargs)
+            return self._process_results(results, frame, confidence_threshold)
             
-            return {
-                'detections': detections,
-                'object_counts': object_counts,
-                'annotated_frame': annotated_frame
-            }
+        except Exception as e:
+            logger.error(f"Error during object detection: {e}")
+            return self._empty_result(frame)
+    
+    def detect_batch(self, frames: List[np.ndarray], confidence_thresholds: List[float]) -> List[Dict]:
+        """
+        Detect objects in several frames with a single model call
+        
+        Args:
+            frames: Input image frames, all of the same shape
+            confidence_thresholds: Minimum confidence for detections, one per frame
             
+        Returns:
+            List of detection dictionaries, in the same order as frames
+        """
+        if not self.loaded:
+            return [self._empty_result(frame) for frame in frames]
+        
+        try:
+            # Ultralytics accepts a list of images and runs them as one batch
+            results = self.model(frames, **self._infer_kwargs)
         except Exception as e:
-            print(f"Error during object detection: {e}")
-            return {
-                'detections': [],
-                'object_counts': {},
-                'annotated_frame': frame
+            logger.error(f"Error during batched object detection: {e}")
+            return [self._empty_result(frame) for frame in frames]
+        return [
+            self._process_results([result], frame, threshold)
+            for result, frame, threshold in zip(results, frames, confidence_thresholds)
+        ]
+    
+    def detect_batch_gpu(self, frames: List[np.ndarray], confidence_thresholds: List[float]):
+        """
+        Detect objects in several frames, keeping the pixels on the GPU
+        
+        The frames are uploaded once, fed to the model as a tensor and annotated in place,
+        so only box coordinates come back to the host. Requires CUDA.
+        
+        Returns:
+            Tuple of (list of detection dictionaries, annotated BGR uint8 tensor of shape BxHxWx3)
+        """
+        import torch
+        
+        batch = torch.from_numpy(np.stack(frames)).cuda(non_blocking=True)
+        # Ultralytics takes tensors as RGB BCHW floats in [0, 1] and skips its own preprocessing
+        model_input = batch.flip(-1).permute(0, 3, 1, 2).float().div_(255.0)
+        results = self.model(model_input, **self._infer_kwargs)
+        
+        outputs = []
+        for result, image, threshold in zip(results, batch, confidence_thresholds):
+            output = self._extract_detections([result], threshold)
+            for detection in output['detections']:
+                bbox = detection['bbox']
+                self._draw_box_gpu(image, bbox['x1'], bbox['y1'], bbox['x2'], bbox['y2'],
+                                   detection['class_id'], f"{detection['class_name']}: {detection['confidence']:.2f}")
+            output['annotated_frame'] = None  # Annotated pixels only exist on the GPU
+            outputs.append(output)
+        return outputs, batch
+    
+    def _process_results(self, results, frame: np.ndarray, confidence_threshold: float) -> Dict:
+        """Convert raw YOLO results into detections, counts and an annotated frame"""
+        output = self._extract_detections(results, confidence_threshold)
+        output['annotated_frame'] = self.draw_detections(frame, output['detections'])
+        return output
+    
+    @staticmethod
+    def _empty_result(frame: Optional[np.ndarray]) -> Dict:
+        """Detection dictionary for a frame with nothing detected"""
+        return {
+            'detections': [],
+            'object_counts': {},
+            'boxes': np.empty((0, 4), dtype=np.int32),
+            'confidences': np.empty(0, dtype=np.float32),
+            'class_ids': np.empty(0, dtype=np.int32),
+            'annotated_frame': frame
+        }
+    
+    def _extract_detections(self, results, confidence_threshold: float) -> Dict:
+        """
+        Turn raw YOLO results into detection records and per-class counts
+        
+        The same detections are also returned as arrays ('boxes' as Nx4 int32 xyxy,
+        'confidences', 'class_ids') for callers that work on all boxes at once.
+        """
+        boxes, confidences, class_ids = self._result_arrays(results, confidence_threshold)
+        names = self._names
+        widths = boxes[:, 2] - boxes[:, 0]
+        heights = boxes[:, 3] - boxes[:, 1]
+        
+        # Create detection records
+        detections = [
+            {
+                'class_id': class_id,
+                'class_name': names[class_id],
+                'confidence': confidence,
+                'bbox': {
+                    'x1': x1,
+                    'y1': y1,
+                    'x2': x2,
+                    'y2': y2,
+                    'width': width,
+                    'height': height
+                }
             }
+            for (x1, y1, x2, y2), width, height, confidence, class_id
+            in zip(boxes.tolist(), widths.tolist(), heights.tolist(), confidences.tolist(), class_ids.tolist())
+        ]
+        
+        # Count objects per class in one pass
+        counts = np.bincount(class_ids, minlength=len(names))
+        present = np.flatnonzero(counts)
+        object_counts = {names[class_id]: count for class_id, count in zip(present.tolist(), counts[present].tolist())}
+        
+        return {
+            'detections': detections,
+            'object_counts': object_counts,
+            'boxes': boxes,
+            'confidences': confidences,
+            'class_ids': class_ids
+        }
+    
+    @staticmethod
+    def _result_arrays(results, confidence_threshold: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Pull boxes out of YOLO results as arrays, one device-to-host copy per tensor
+        
+        Returns:
+            Tuple of (Nx4 int32 xyxy boxes, N float32 confidences, N int32 class ids)
+            for the detections at or above the confidence threshold
+        """
+        all_boxes, all_confidences, all_class_ids = [], [], []
+        for result in results:
+            boxes = result.boxes
+            if boxes is not None and len(boxes):
+                all_boxes.append(boxes.xyxy.cpu().numpy())
+                all_confidences.append(boxes.conf.cpu().numpy())
+                all_class_ids.append(boxes.cls.cpu().numpy())
+        
+        if not all_boxes:
+            return np.empty((0, 4), dtype=np.int32), np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int32)
+        
+        confidences = np.concatenate(all_confidences).astype(np.float32)
+        keep = confidences >= confidence_threshold
+        return (np.concatenate(all_boxes)[keep].astype(np.int32),
+                confidences[keep],
+                np.concatenate(all_class_ids)[keep].astype(np.int32))
+    
+    def draw_detections(self, frame: np.ndarray, detections: List[Dict]) -> np.ndarray:
+        """
+        Return a copy of frame with the given detection records drawn on it
+        
+        With no detections there is nothing to draw and frame itself is returned, so callers
+        must not modify the result in place.
+        """
+        annotated_frame = None
+        for detection in detections:
+            if annotated_frame is None:
+                annotated_frame = frame.copy()
+            bbox = detection['bbox']
+            self._draw_box(annotated_frame, bbox['x1'], bbox['y1'], bbox['x2'], bbox['y2'],
+                           detection['class_id'], f"{detection['class_name']}: {detection['confidence']:.2f}")
+        return annotated_frame if annotated_frame is not None else frame
+    
+    def _draw_box(self, image: np.ndarray, x1: int, y1: int, x2: int, y2: int, class_id: int, label: str):
+        """Draw one bounding box with a filled label background"""
+        color = self._get_class_color(class_id)
+        cv2.rectangle(image, (x1, y1), (x2, y2), color, 2)
+        
+        # Background rectangle for label
+        cv2.rectangle(image,
+                    (x1, y1 - LABEL_HEIGHT - 10),
+                    (x1 + _label_width(label), y1),
+                    color, -1)
+        
+        # Label text
+        cv2.putText(image, label,
+                  (x1, y1 - 5),
+                  LABEL_FONT, 0.5, (255, 255, 255), 2)
+    
+    def _draw_box_gpu(self, image, x1: int, y1: int, x2: int, y2: int, class_id: int, label: str):
+        """Draw one bounding box into an HxWx3 uint8 CUDA tensor"""
+        import torch
+        
+        height, width = image.shape[:2]
+        x1, x2 = max(0, x1), min(width, x2)
+        y1, y2 = max(0, y1), min(height, y2)
+        if x2 <= x1 or y2 <= y1:
+            return
+        
+        color = torch.tensor(self._get_class_color(class_id), dtype=torch.uint8, device=image.device)
+        image[y1:y1 + 2, x1:x2] = color
+        image[max(y1, y2 - 2):y2, x1:x2] = color
+        image[y1:y2, x1:x1 + 2] = color
+        image[y1:y2, max(x1, x2 - 2):x2] = color
+        
+        # Text can't be rasterized on the GPU, so render the small label patch on the CPU
+        patch = np.empty((LABEL_HEIGHT + 10, _label_width(label), 3), dtype=np.uint8)
+        patch[:] = self._get_class_color(class_id)
+        cv2.putText(patch, label, (0, LABEL_HEIGHT + 5), LABEL_FONT, 0.5, (255, 255, 255), 2)
+        
+        top = y1 - patch.shape[0]
+        patch_top = max(0, -top)
+        patch_width = min(patch.shape[1], width - x1)
+        if patch_top < patch.shape[0] and patch_width > 0:
+            image[max(0, top):y1, x1:x1 + patch_width] = torch.from_numpy(
+                patch[patch_top:, :patch_width]
+            ).to(image.device, non_blocking=True)
     
     def _get_class_color(self, class_id: int) -> Tuple[int, int, int]:
         """Get consistent color for each object class"""
-        colors = [
-            (255, 0, 0),    # Red
-            (0, 255, 0),    # Green
-            (0, 0, 255),    # Blue
-            (255, 255, 0),  # Yellow
-            (255, 0, 255),  # Magenta
-            (0, 255, 255),  # Cyan
-            (128, 0, 128),  # Purple
-            (255, 165, 0),  # Orange
-            (255, 192, 203), # Pink
-            (0, 128, 0),    # Dark Green
-        ]
-        return colors[class_id % len(colors)]
+        return tuple(self._color_lut[class_id % len(self._color_lut)].tolist())
+
+class FrameEncoder:
+    def __init__(self, backend: str = JPEG_ENCODER):
+        """Initialize JPEG encoder, using nvJPEG on the GPU when requested and available"""
+        self.backend = 'opencv'
+        self._turbojpeg = None
+        if backend in ('nvjpeg', 'turbojpeg'):
+            self._init_turbojpeg()
+        if backend == 'nvjpeg':
+            try:
+                import torch
+                from torchvision.io import encode_jpeg
+                if torch.cuda.is_available():
+                    self._torch = torch
+                    self._encode_jpeg = encode_jpeg
+                    self.backend = 'nvjpeg'
+                else:
+                    logger.warning("nvJPEG encoder requested but CUDA is not available")
+            except ImportError as e:
+                logger.warning(f"nvJPEG encoder unavailable: {e}")
+        logger.info(f"Frame encoder using {self.backend}")
+    
+    def _init_turbojpeg(self):
+        """Load libjpeg-turbo as the CPU encoder if it is installed"""
+        try:
+            from turbojpeg import TurboJPEG, TJFLAG_FASTDCT, TJFLAG_FASTUPSAMPLE, TJSAMP_420
+            self._turbojpeg = TurboJPEG()
+            # SIMD fast DCT/upsampling; Huffman tables are left unoptimized (libjpeg-turbo default)
+            self._turbojpeg_flags = TJFLAG_FASTDCT | TJFLAG_FASTUPSAMPLE
+            self._turbojpeg_subsample = TJSAMP_420
+            self.backend = 'turbojpeg'
+        except Exception as e:
+            logger.warning(f"TurboJPEG encoder unavailable, using OpenCV: {e}")
+    
+    def encode(self, frame: np.ndarray, quality: int = 85) -> Union[bytes, memoryview]:
+        """Encode a single BGR frame to JPEG bytes"""
+        return self.encode_batch([frame], quality)[0]
+    
+    def encode_batch(self, frames: List[np.ndarray], quality: int = 85) -> List[Union[bytes, memoryview]]:
+        """Encode several BGR frames to JPEG bytes, in one GPU call when using nvJPEG"""
+        if self.backend == 'nvjpeg':
+            try:
+                # nvJPEG expects RGB CHW uint8 tensors on the device
+                tensors = [
+                    self._torch.from_numpy(np.ascontiguousarray(frame[:, :, ::-1]))
+                    .cuda(non_blocking=True).permute(2, 0, 1)
+                    for frame in frames
+                ]
+                encoded = self._encode_jpeg(tensors, quality=quality)
+                return [memoryview(data.cpu().numpy()) for data in encoded]
+            except Exception as e:
+                logger.warning(f"nvJPEG encode failed, falling back to CPU encoder: {e}")
+                self.backend = 'turbojpeg' if self._turbojpeg else 'opencv'
+        
+        if self.backend == 'turbojpeg':
+            return [
+                self._turbojpeg.encode(frame, quality=quality,
+                                       jpeg_subsample=self._turbojpeg_subsample,
+                                       flags=self._turbojpeg_flags)
+                for frame in frames
+            ]
+        
+        return self._encode_opencv(frames, quality)
+    
+    def encode_tensors(self, images, quality: int = 85) -> List[Union[bytes, memoryview]]:
+        """Encode BGR HxWx3 uint8 CUDA tensors without copying the pixels back to the host"""
+        if self.backend == 'nvjpeg':
+            try:
+                encoded = self._encode_jpeg([image.flip(-1).permute(2, 0, 1).contiguous() for image in images],
+                                            quality=quality)
+                return [memoryview(data.cpu().numpy()) for data in encoded]
+            except Exception as e:
+                logger.warning(f"nvJPEG encode failed, falling back to CPU encoder: {e}")
+                self.backend = 'turbojpeg' if self._turbojpeg else 'opencv'
+        
+        return self.encode_batch([image.cpu().numpy() for image in images], quality)
+    
+    def _encode_opencv(self, frames: List[np.ndarray], quality: int) -> List[Union[bytes, memoryview]]:
+        buffers = []
+        for frame in frames:
+            _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            # Expose the encoded array without copying it into a new bytes object
+            buffers.append(memoryview(buffer))
+        return buffers
+
+class BatchedDetector:
+    """Collects frames from all camera tasks and runs them through the model in batches"""
+    
+    def __init__(self, detector: ObjectDetector, max_batch_size: int = 8, max_wait: float = 0.01,
+                 encoder: Optional[FrameEncoder] = None, jpeg_quality: int = 85):
+        # Any backend with detect_batch(frames, thresholds) and _empty_result(frame), e.g. ObjectDetector
+        self.detector = detector
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait  # Seconds to wait for more frames before running a partial batch
+        self.encoder = encoder  # When set, annotated frames are JPEG-encoded as one batch
+        self.jpeg_quality = jpeg_quality
+        self.queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.gpu_pipeline = GPU_FRAME_PIPELINE and encoder is not None and encoder.backend == 'nvjpeg'
+        # Inference blocks for the duration of the GPU/CPU call, so it runs off the event loop.
+        # One worker: the Ultralytics predictor is not thread-safe and batches are already serialized.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='yolo-inference',
+                                            initializer=_pin_inference_thread)
+    
+    @property
+    def loaded(self) -> bool:
+        return self.detector.loaded
+    
+    def _infer_batch(self, frames: List[np.ndarray], thresholds: List[float]) -> List[Dict]:
+        """Run detection (and JPEG encoding) for one batch; called on the inference thread"""
+        if self.gpu_pipeline and self.detector.loaded:
+            results, annotated_images = self.detector.detect_batch_gpu(frames, thresholds)
+            jpegs = self.encoder.encode_tensors(list(annotated_images), self.jpeg_quality)
+            for result, jpeg in zip(results, jpegs):
+                result['jpeg'] = jpeg
+            return results
+        
+        results = self.detector.detect_batch(frames, thresholds)
+        if self.encoder:
+            jpegs = self.encoder.encode_batch(
+                [result['annotated_frame'] for result in results], self.jpeg_quality
+            )
+            for result, jpeg in zip(results, jpegs):
+                result['jpeg'] = jpeg
+        return results
+    
+    def start(self):
+        """Start the batch coordinator on the running event loop"""
+        if self._task is None or self._task.done():
+            self.queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run_batches())
+    
+    async def submit(self, frame: np.ndarray, confidence_threshold: float = 0.5) -> Dict:
+        """Queue a frame for detection and wait for its result"""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((frame, confidence_threshold, future))
+        return await future
+    
+    async def _run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            
+            # Give other cameras a short window to join this batch
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            frames = [frame for frame, _, _ in batch]
+            thresholds = [threshold for _, threshold, _ in batch]
+            try:
+                results = await loop.run_in_executor(self._executor, self._infer_batch, frames, thresholds)
+            except Exception as e:
+                # One failed batch must not end every camera loop waiting on it
+                logger.error(f"Error during batched object detection: {e}")
+                results = [self.detector._empty_result(frame) for frame in frames]
+            
+            for (_, _, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+class BoxTracker:
+    """Carries the last detections forward between YOLO runs using sparse optical flow"""
+    
+    def __init__(self, points_per_side: int = 3):
+        self.points_per_side = points_per_side  # Grid of points sampled inside each box
+        self.prev_gray: Optional[np.ndarray] = None
+        self.detections: List[Dict] = []
+    
+    def reset(self, frame: np.ndarray, detections: List[Dict]):
+        """Start tracking a fresh set of detections on a reference frame"""
+        self.prev_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        self.detections = [dict(detection, bbox=dict(detection['bbox'])) for detection in detections]
+    
+    def clear(self):
+        self.prev_gray = None
+        self.detections = []
+    
+    def update(self, frame: np.ndarray) -> List[Dict]:
+        """Shift every tracked box by the median motion of the points inside it"""
+        if self.prev_gray is None or not self.detections:
+            return self.detections
+        
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        
+        # Sample an interior grid of points for every box
+        steps = (np.arange(self.points_per_side, dtype=np.float32) + 1) / (self.points_per_side + 1)
+        points = []
+        for detection in self.detections:
+            bbox = detection['bbox']
+            xs = bbox['x1'] + steps * (bbox['x2'] - bbox['x1'])
+            ys = bbox['y1'] + steps * (bbox['y2'] - bbox['y1'])
+            grid_x, grid_y = np.meshgrid(xs, ys)
+            points.append(np.stack([grid_x.ravel(), grid_y.ravel()], axis=1))
+        prev_points = np.concatenate(points).astype(np.float32).reshape(-1, 1, 2)
+        
+        next_points, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, prev_points, None,
+                                                          winSize=(15, 15), maxLevel=2)
+        flow = (next_points - prev_points).reshape(-1, self.points_per_side ** 2, 2)
+        tracked = status.reshape(-1, self.points_per_side ** 2) == 1
+        
+        height, width = gray.shape
+        for detection, box_flow, box_tracked in zip(self.detections, flow, tracked):
+            if not box_tracked.any():
+                continue
+            dx, dy = np.median(box_flow[box_tracked], axis=0)
+            bbox = detection['bbox']
+            bbox['x1'] = int(np.clip(bbox['x1'] + dx, 0, width - 1))
+            bbox['y1'] = int(np.clip(bbox['y1'] + dy, 0, height - 1))
+            bbox['x2'] = int(np.clip(bbox['x1'] + bbox['width'], 0, width - 1))
+            bbox['y2'] = int(np.clip(bbox['y1'] + bbox['height'], 0, height - 1))
+        
+        self.prev_gray = gray
+        return self.detections
+
+class ThreadedCapture:
+    """Reads frames from a VideoCapture on a background thread, keeping only the newest one"""
+    
+    def __init__(self, cap: cv2.VideoCapture):
+        self.cap = cap
+        self.running = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+    
+    def start(self) -> 'ThreadedCapture':
+        """Start reading; must be called from the event loop that will consume frames"""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=1)
+        self.running = True
+        self._thread = threading.Thread(target=self._reader, daemon=True)
+        self._thread.start()
+        return self
+    
+    def _reader(self):
+        try:
+            while self.running:
+                ret, frame = self.cap.read()
+                if not ret:
+                    time.sleep(0.1)
+                    continue
+                self._loop.call_soon_threadsafe(self._put_latest, frame)
+        except RuntimeError:
+            # Event loop closed while we were still reading
+            pass
+        finally:
+            # Release from the reader thread so read() is never racing release()
+            self.cap.release()
+    
+    def _put_latest(self, frame: np.ndarray):
+        # Drop the unread frame so consumers always get the most recent one
+        if self._queue.full():
+            self._queue.get_nowait()
+        self._queue.put_nowait(frame)
+    
+    async def read(self, timeout: float = 1.0) -> Optional[np.ndarray]:
+        """Wait for the next frame, or return None if none arrives within timeout"""
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+    
+    def stop(self):
+        self.running = False
 
 class CameraManager:
-    def __init__(self):
+    def __init__(self, detector: Optional[ObjectDetector] = None):
         self.active_streams = {}
-        self.detector = ObjectDetector()
+        # Shared with the rest of the app so the weights are only loaded once
+        self.detector = detector
     
     def get_ip_webcam_urls(self, ip_address: str, port: int = 8080) -> Dict[str, str]:
         """Generate IP Webcam URLs for different stream types"""
@@ -142,25 +714,40 @@ class CameraManager:
             'settings': f"{base_url}/settings"
         }
     
-    def test_camera_connection(self, ip_address: str, port: int = 8080) -> bool:
+    async def test_camera_connection(self, ip_address: str, port: int = 8080) -> bool:
         """Test if camera is accessible"""
         try:
-            import requests
             urls = self.get_ip_webcam_urls(ip_address, port)
-            response = requests.get(urls['status'], timeout=5)
+            response = await http_client.get(urls['status'])
             return response.status_code == 200
         except Exception as e:
-            print(f"Camera connection test failed: {e}")
+            logger.warning(f"Camera connection test failed: {e}")
             return False
     
+    def open_video_capture(self, ip_address: str, port: int = 8080,
+                           width: int = 640, height: int = 480) -> cv2.VideoCapture:
+        """Open the camera video stream, preferring a GStreamer hardware-decode pipeline"""
+        video_url = self.get_ip_webcam_urls(ip_address, port)['video']
+        
+        if HW_VIDEO_DECODE and GSTREAMER_AVAILABLE:
+            pipeline = GST_CAMERA_PIPELINE.format(url=video_url, width=width, height=height)
+            cap = cv2.VideoCapture(pipeline, cv2.CAP_GSTREAMER)
+            if cap.isOpened():
+                logger.info(f"Using hardware-decoded GStreamer pipeline for {video_url}")
+                return cap
+            cap.release()
+            logger.warning(f"GStreamer pipeline failed to open for {video_url}, using default decoder")
+        
+        cap = cv2.VideoCapture(video_url)
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return cap
+    
     def create_camera_stream(self, ip_address: str, port: int = 8080) -> Optional[cv2.VideoCapture]:
         """Create OpenCV VideoCapture for IP camera"""
         try:
-            urls = self.get_ip_webcam_urls(ip_address, port)
-            cap = cv2.VideoCapture(urls['video'])
+            cap = self.open_video_capture(ip_address, port)
             
             # Configure capture properties
-            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
             cap.set(cv2.CAP_PROP_FPS, 10)
             
             # Test if we can read a frame
@@ -172,35 +759,158 @@ class CameraManager:
                 return None
                 
         except Exception as e:
-            print(f"Error creating camera stream: {e}")
+            logger.error(f"Error creating camera stream: {e}")
             return None
 
+# Detection records are written to Firestore in batches: every DETECTION_FLUSH_INTERVAL seconds,
+# or as soon as DETECTION_BATCH_SIZE records are queued (Firestore allows 500 writes per batch)
+DETECTION_FLUSH_INTERVAL = 2.0
+DETECTION_BATCH_SIZE = 400
+# Detections kept in memory per camera; older ones are evicted as new ones arrive
+DETECTION_HISTORY_SIZE = 2000
+# Everything AnalyticsManager._generate_analytics_summary can compute
+SUMMARY_FIELDS = frozenset({'total_objects', 'object_types', 'recent_activity', 'hourly_distribution'})
+
+class DetectionHistory:
+    """
+    Columnar detection history for one camera: a timestamp and a row of per-class counts per frame
+    
+    Rows live in a buffer twice the capacity. When it fills up, the newest rows are moved back to
+    the front, so appends are amortized O(1) and the live rows are always one contiguous,
+    chronologically ordered slice that NumPy can aggregate directly.
+    """
+    
+    def __init__(self, capacity: int = DETECTION_HISTORY_SIZE, num_classes: int = 8):
+        self.capacity = capacity
+        self._timestamps = np.empty(2 * capacity, dtype='datetime64[us]')
+        self._counts = np.zeros((2 * capacity, num_classes), dtype=np.int32)
+        self._totals = np.zeros(2 * capacity, dtype=np.int64)  # Row sums, computed once at insert
+        self._isoformats = np.empty(2 * capacity, dtype=object)  # Timestamp strings, formatted once at insert
+        self._start = 0
+        self._end = 0
+    
+    def __len__(self) -> int:
+        return self._end - self._start
+    
+    @property
+    def timestamps(self) -> np.ndarray:
+        return self._timestamps[self._start:self._end]
+    
+    @property
+    def counts(self) -> np.ndarray:
+        """(frames, classes) counts; columns are class indices assigned by AnalyticsManager"""
+        return self._counts[self._start:self._end]
+    
+    @property
+    def totals(self) -> np.ndarray:
+        """Objects detected per frame"""
+        return self._totals[self._start:self._end]
+    
+    @property
+    def isoformats(self) -> np.ndarray:
+        """Timestamps as ISO 8601 strings"""
+        return self._isoformats[self._start:self._end]
+    
+    def index_after(self, cutoff_time: datetime) -> int:
+        """Index of the first row newer than cutoff_time; rows are in time order, so this is a binary search"""
+        return int(np.searchsorted(self.timestamps, np.datetime64(cutoff_time, 'us'), side='right'))
+    
+    def append(self, timestamp: datetime, class_indices: List[int], counts: List[int]):
+        if self._end == len(self._timestamps):
+            live = len(self)
+            self._timestamps[:live] = self.timestamps
+            self._counts[:live] = self.counts
+            self._counts[live:] = 0
+            self._totals[:live] = self.totals
+            self._isoformats[:live] = self.isoformats
+            self._isoformats[live:] = None
+            self._start, self._end = 0, live
+        
+        if class_indices and max(class_indices) >= self._counts.shape[1]:
+            extra = max(class_indices) + 1 - self._counts.shape[1]
+            self._counts = np.pad(self._counts, ((0, 0), (0, extra)))
+        
+        row = self._end
+        self._timestamps[row] = np.datetime64(timestamp, 'us')
+        self._counts[row, class_indices] = counts
+        self._totals[row] = sum(counts)
+        self._isoformats[row] = timestamp.isoformat()
+        self._end += 1
+        if len(self) > self.capacity:
+            self._start += 1
+
 class AnalyticsManager:
-    def __init__(self, firestore_client=None):
-        self.detection_history = {}
+    def __init__(self, firestore_client=None, history_size: int = DETECTION_HISTORY_SIZE):
+        self.detection_history: Dict[str, DetectionHistory] = {}
+        self.history_size = history_size
         self.db = firestore_client
+        # Detection records waiting for the next batched Firestore write
+        self._write_buffer: List[Dict] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        # Early flushes started when the buffer fills; referenced here so they are not garbage-collected
+        self._pending_flushes: Set[asyncio.Task] = set()
+        # Object type <-> column index in every DetectionHistory
+        self._class_index: Dict[str, int] = {}
+        self._class_names: List[str] = []
     
     def set_firestore_client(self, firestore_client):
         """Set the Firestore client after initialization"""
         self.db = firestore_client
     
-    async def save_detection_to_firestore(self, camera_id: str, object_counts: Dict[str, int]):
-        """Save detection data directly to Firestore"""
+    def queue_detection(self, camera_id: str, object_counts: Dict[str, int]):
+        """Queue detection data for the next batched Firestore write"""
         if not self.db:
-            print("Firestore client not available")
+            logger.warning("Firestore client not available")
             return
         
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+        
+        self._write_buffer.append({
+            'camera_id': camera_id,
+            'object_counts': dict(object_counts),
+            'timestamp': datetime.now().isoformat()
+        })
+        if len(self._write_buffer) >= DETECTION_BATCH_SIZE:
+            flush = asyncio.create_task(self.flush_detections())
+            self._pending_flushes.add(flush)
+            flush.add_done_callback(self._flush_done)
+    
+    def _flush_done(self, flush: asyncio.Task):
+        self._pending_flushes.discard(flush)
+        if not flush.cancelled() and flush.exception() is not None:
+            logger.error(f"Error flushing detection records: {flush.exception()}")
+    
+    async def close(self):
+        """Stop the periodic flush and write every queued detection record"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        if self._pending_flushes:
+            await asyncio.gather(*self._pending_flushes, return_exceptions=True)
+        await self.flush_detections()
+    
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(DETECTION_FLUSH_INTERVAL)
+            await self.flush_detections()
+    
+    async def flush_detections(self):
+        """Write all queued detection records, DETECTION_BATCH_SIZE documents per WriteBatch"""
+        if not self.db or not self._write_buffer:
+            return
+        
+        pending, self._write_buffer = self._write_buffer, []
+        detections_ref = self.db.collection('detections')
         try:
-            detection_data = {
-                'camera_id': camera_id,
-                'object_counts': object_counts,
-                'timestamp': datetime.now().isoformat()
-            }
-            
-            await self.db.collection('detections').add(detection_data)
-            print(f"Saved detection data to Firestore for camera {camera_id}")
+            for start in range(0, len(pending), DETECTION_BATCH_SIZE):
+                batch = self.db.batch()
+                for record in pending[start:start + DETECTION_BATCH_SIZE]:
+                    batch.set(detections_ref.document(), record)
+                await batch.commit()
+            logger.info(f"Saved {len(pending)} detection records to Firestore")
         except Exception as e:
-            print(f"Error saving detection to Firestore: {e}")
+            logger.error(f"Error saving detection to Firestore: {e}")
     
     async def get_analytics_from_firestore(self, camera_id: str, hours: int = 24) -> List[Dict]:
         """Get analytics data from Firestore"""
@@ -221,86 +931,99 @@ class AnalyticsManager:
             
             return result
         except Exception as e:
-            print(f"Error fetching analytics from Firestore: {e}")
+            logger.error(f"Error fetching analytics from Firestore: {e}")
             return []
     
-    def process_detection_data(self, camera_id: str, object_counts: Dict[str, int]) -> Dict:
-        """Process and aggregate detection data"""
+    def _class_indices(self, object_types) -> List[int]:
+        indices = []
+        for obj_type in object_types:
+            index = self._class_index.get(obj_type)
+            if index is None:
+                index = self._class_index[obj_type] = len(self._class_names)
+                self._class_names.append(obj_type)
+            indices.append(index)
+        return indices
+    
+    def _counts_dict(self, counts: np.ndarray) -> Dict[str, int]:
+        """Turn a row of per-class counts back into {object_type: count}, skipping zeros"""
+        return {self._class_names[index]: count
+                for index, count in zip(np.flatnonzero(counts).tolist(), counts[counts != 0].tolist())}
+    
+    def process_detection_data(self, camera_id: str, object_counts: Dict[str, int],
+                               summary_fields: Optional[Set[str]] = None) -> Dict:
+        """Process and aggregate detection data; summary_fields limits the returned summary"""
         timestamp = datetime.now()
         
-        # Store detection data in memory for immediate processing
-        if camera_id not in self.detection_history:
-            self.detection_history[camera_id] = []
+        # Store detection data in memory for immediate processing; only the last
+        # history_size detections per camera are kept
+        history = self.detection_history.get(camera_id)
+        if history is None:
+            history = self.detection_history[camera_id] = DetectionHistory(self.history_size)
+        history.append(timestamp, self._class_indices(object_counts), list(object_counts.values()))
         
-        self.detection_history[camera_id].append({
-            'timestamp': timestamp,
-            'object_counts': object_counts.copy()
-        })
-        
-        # Keep only last 2000 detections per camera for memory efficiency
-        if len(self.detection_history[camera_id]) > 2000:
-            self.detection_history[camera_id] = self.detection_history[camera_id][-2000:]
-        
-        # Also save to Firestore if available (async)
+        # Also save to Firestore if available (batched)
         if self.db:
-            asyncio.create_task(self.save_detection_to_firestore(camera_id, object_counts))
+            self.queue_detection(camera_id, object_counts)
         
-        return self._generate_analytics_summary(camera_id)
+        return self._generate_analytics_summary(camera_id, summary_fields)
     
-    def _generate_analytics_summary(self, camera_id: str) -> Dict:
-        """Generate analytics summary for camera"""
-        if camera_id not in self.detection_history:
-            return {
-                'total_objects': 0,
-                'object_types': {},
-                'recent_activity': [],
-                'hourly_distribution': {}
-            }
+    def _generate_analytics_summary(self, camera_id: str, fields: Optional[Set[str]] = None) -> Dict:
+        """
+        Generate analytics summary for camera
         
-        history = self.detection_history[camera_id]
+        Args:
+            camera_id: Camera to summarize
+            fields: Summary keys to compute (default: all of SUMMARY_FIELDS)
+        """
+        fields = SUMMARY_FIELDS if fields is None else fields
+        history = self.detection_history.get(camera_id)
         if not history:
-            return {
+            empty_summary = {
                 'total_objects': 0,
                 'object_types': {},
                 'recent_activity': [],
                 'hourly_distribution': {}
             }
+            return {field: value for field, value in empty_summary.items() if field in fields}
         
-        # Calculate totals
-        total_objects = 0
-        object_types = {}
-        hourly_distribution = {}
+        # Summarize the last 20 detections
+        counts = history.counts[-20:]
+        totals = history.totals[-20:]
+        summary = {}
         
-        # Get recent activity (last 20 detections)
-        recent_activity = []
-        for record in history[-20:]:
-            total_in_frame = sum(record['object_counts'].values())
-            total_objects += total_in_frame
-            
-            hour_key = record['timestamp'].strftime('%H:00')
-            if hour_key not in hourly_distribution:
-                hourly_distribution[hour_key] = {}
-            
-            for obj_type, count in record['object_counts'].items():
-                object_types[obj_type] = object_types.get(obj_type, 0) + count
-                hourly_distribution[hour_key][obj_type] = hourly_distribution[hour_key].get(obj_type, 0) + count
-            
-            recent_activity.append({
-                'timestamp': record['timestamp'].isoformat(),
-                'object_counts': record['object_counts'],
-                'total_in_frame': total_in_frame
-            })
+        if 'total_objects' in fields:
+            summary['total_objects'] = int(totals.sum())
         
-        return {
-            'total_objects': total_objects,
-            'object_types': object_types,
-            'recent_activity': recent_activity,
-            'hourly_distribution': hourly_distribution
-        }
+        if 'object_types' in fields:
+            summary['object_types'] = self._counts_dict(counts.sum(axis=0))
+        
+        if 'recent_activity' in fields:
+            summary['recent_activity'] = [
+                {
+                    'timestamp': timestamp,
+                    'object_counts': self._counts_dict(row),
+                    'total_in_frame': total
+                }
+                for timestamp, row, total in zip(history.isoformats[-20:].tolist(), counts, totals.tolist())
+            ]
+        
+        if 'hourly_distribution' in fields:
+            # Group by hour of day
+            timestamps = history.timestamps[-20:]
+            hour_of_day = (timestamps.astype('datetime64[h]') - timestamps.astype('datetime64[D]')).astype(np.int64)
+            hours, hour_rows = np.unique(hour_of_day, return_inverse=True)
+            hourly_counts = np.zeros((len(hours), counts.shape[1]), dtype=np.int64)
+            np.add.at(hourly_counts, hour_rows, counts)
+            summary['hourly_distribution'] = {
+                f"{hour:02d}:00": self._counts_dict(row) for hour, row in zip(hours.tolist(), hourly_counts)
+            }
+        
+        return summary
     
     def get_hourly_stats(self, camera_id: str, hours: int = 24) -> List[Dict]:
         """Get hourly statistics for camera"""
-        if camera_id not in self.detection_history:
+        history = self.detection_history.get(camera_id)
+        if not history:
             return []
         
         from datetime import timedelta
@@ -308,93 +1031,77 @@ class AnalyticsManager:
         cutoff_time = now - timedelta(hours=hours)
         
         # Filter recent data
-        recent_data = [
-            record for record in self.detection_history[camera_id]
-            if record['timestamp'] > cutoff_time
-        ]
+        first = history.index_after(cutoff_time)
+        timestamps = history.timestamps[first:]
+        counts = history.counts[first:]
+        if not len(timestamps):
+            return []
         
-        # Group by hour
-        hourly_stats = {}
-        for record in recent_data:
-            hour_key = record['timestamp'].strftime('%Y-%m-%d %H:00')
-            if hour_key not in hourly_stats:
-                hourly_stats[hour_key] = {}
-            
-            for obj_type, count in record['object_counts'].items():
-                hourly_stats[hour_key][obj_type] = hourly_stats[hour_key].get(obj_type, 0) + count
+        # Group by hour: timestamps are in order, so each hour is one run of rows
+        hour_keys = timestamps.astype('datetime64[h]')
+        run_starts = np.flatnonzero(np.r_[True, hour_keys[1:] != hour_keys[:-1]])
+        hourly_counts = np.add.reduceat(counts, run_starts, axis=0)
         
         # Convert to list format
-        result = []
-        for hour, counts in sorted(hourly_stats.items()):
-            result.append({
-                'hour': hour,
-                'object_counts': counts,
-                'total': sum(counts.values())
-            })
-        
-        return result
+        return [
+            {
+                'hour': hour.strftime('%Y-%m-%d %H:00'),
+                'object_counts': self._counts_dict(row),
+                'total': total
+            }
+            for hour, row, total in zip(hour_keys[run_starts].tolist(), hourly_counts, hourly_counts.sum(axis=1).tolist())
+        ]
     
     def get_object_type_stats(self, camera_id: str) -> Dict[str, int]:
         """Get total count by object type"""
-        if camera_id not in self.detection_history:
+        history = self.detection_history.get(camera_id)
+        if history is None:
             return {}
         
-        object_stats = {}
-        for record in self.detection_history[camera_id]:
-            for obj_type, count in record['object_counts'].items():
-                object_stats[obj_type] = object_stats.get(obj_type, 0) + count
-        
-        return object_stats
+        return self._counts_dict(history.counts.sum(axis=0))
     
     def get_peak_detection_time(self, camera_id: str) -> Optional[Dict]:
         """Get time with most detections"""
-        if camera_id not in self.detection_history:
-            return None
-        
-        history = self.detection_history[camera_id]
+        history = self.detection_history.get(camera_id)
         if not history:
             return None
         
-        peak_record = max(
-            history,
-            key=lambda r: sum(r['object_counts'].values()),
-            default=None
-        )
-        
-        if peak_record:
-            total = sum(peak_record['object_counts'].values())
-            return {
-                'timestamp': peak_record['timestamp'].isoformat(),
-                'total_objects': total,
-                'object_counts': peak_record['object_counts']
-            }
-        
-        return None
+        peak = int(history.totals.argmax())
+        return {
+            'timestamp': history.isoformats[peak],
+            'total_objects': int(history.totals[peak]),
+            'object_counts': self._counts_dict(history.counts[peak])
+        }
     
     def get_average_detections_per_hour(self, camera_id: str, hours: int = 24) -> float:
         """Calculate average detections per hour"""
-        if camera_id not in self.detection_history:
+        history = self.detection_history.get(camera_id)
+        if history is None:
             return 0.0
         
         from datetime import timedelta
         now = datetime.now()
         cutoff_time = now - timedelta(hours=hours)
         
-        recent_data = [
-            record for record in self.detection_history[camera_id]
-            if record['timestamp'] > cutoff_time
-        ]
-        
-        if not recent_data or hours == 0:
+        recent_totals = history.totals[history.index_after(cutoff_time):]
+        if not len(recent_totals) or hours == 0:
             return 0.0
         
-        total_objects = sum(
-            sum(record['object_counts'].values()) for record in recent_data
-        )
+        total_objects = int(recent_totals.sum())
         
         return total_objects / hours
 
-# Global instances
-detector = ObjectDetector()
-camera_manager = CameraManager()
-analytics_manager = AnalyticsManager()
\ No newline at end of file
+# Global instances, created on first access so that importing this module for its helpers
+# (main.py uses BatchedDetector and http_client) does not load a second YOLO model
+_GLOBAL_INSTANCES = {
+    'detector': ObjectDetector,
+    'camera_manager': lambda: CameraManager(detector=sys.modules[__name__].detector),
+    'analytics_manager': AnalyticsManager,
+}
+
+def __getattr__(name: str):
+    factory = _GLOBAL_INSTANCES.get(name)
+    if factory is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    instance = globals()[name] = factory()
+    return instance
\ No newline at end of file
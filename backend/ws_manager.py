@@ -0,0 +1,100 @@
+"""
+WebSocket fan-out shared by main.py and enhanced_main.py
+
+Every client gets a bounded queue drained by its own relay task, so a slow client only delays
+itself and never stalls the camera loops that broadcast to it.
+"""
+import asyncio
+import logging
+import struct
+from typing import Dict, Hashable, Iterable, Optional, Union
+
+import orjson
+from fastapi import WebSocket
+
+logger = logging.getLogger(__name__)
+
+# Per-client send timeout (seconds); slower clients are disconnected instead of stalling the camera loop
+SEND_TIMEOUT = 0.5
+# Messages buffered per client; when full the oldest is dropped so live video stays current
+CLIENT_QUEUE_SIZE = 4
+
+def pack_binary_message(header: Union[dict, bytes], payload: bytes) -> bytes:
+    """Binary message layout: 4-byte big-endian header length, UTF-8 JSON header, raw payload"""
+    header_bytes = header if isinstance(header, bytes) else orjson.dumps(header)
+    # join() copies the JPEG once; chained "+" would build an intermediate copy per operand
+    return b''.join((struct.pack('>I', len(header_bytes)), header_bytes, payload))
+
+class ConnectionManager:
+    """Tracks connected clients by id; the WebSocket itself is the id when the caller has none"""
+    def __init__(self):
+        self.active_connections: Dict[Hashable, WebSocket] = {}
+        self.queues: Dict[Hashable, asyncio.Queue] = {}
+        self.relay_tasks: Dict[Hashable, asyncio.Task] = {}
+
+    async def connect(self, websocket: WebSocket, client_id: Optional[Hashable] = None):
+        client_id = websocket if client_id is None else client_id
+        await websocket.accept()
+        self.active_connections[client_id] = websocket
+        self.queues[client_id] = asyncio.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        self.relay_tasks[client_id] = asyncio.create_task(self._relay(client_id))
+
+    def disconnect(self, client_id: Hashable):
+        self.active_connections.pop(client_id, None)
+        self.queues.pop(client_id, None)
+
+        # Stop the relay task unless we are being called from it
+        relay_task = self.relay_tasks.pop(client_id, None)
+        if relay_task is not None and relay_task is not asyncio.current_task():
+            relay_task.cancel()
+
+    async def _relay(self, client_id: Hashable):
+        """Forward queued messages to one client in order"""
+        queue = self.queues[client_id]
+        connection = self.active_connections[client_id]
+        while True:
+            message = await queue.get()
+            try:
+                if isinstance(message, bytes):
+                    await asyncio.wait_for(connection.send_bytes(message), SEND_TIMEOUT)
+                else:
+                    await asyncio.wait_for(connection.send_text(message), SEND_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning(f"Timed out sending to {client_id}")
+                break
+            except Exception as e:
+                logger.error(f"Error sending message to {client_id}: {e}")
+                break
+
+        # A reconnect under the same client id may already own a newer relay
+        if self.relay_tasks.get(client_id) is asyncio.current_task():
+            self.disconnect(client_id)
+
+    def _enqueue(self, client_id: Hashable, message):
+        """Queue a message for a client, dropping its oldest pending message if the queue is full"""
+        queue = self.queues.get(client_id)
+        if queue is None:
+            return
+
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            queue.get_nowait()
+            queue.put_nowait(message)
+
+    def _send_to_clients(self, client_ids: Iterable[Hashable], message):
+        """Queue the same message object for several clients"""
+        for client_id in client_ids:
+            self._enqueue(client_id, message)
+
+    async def send_personal_message(self, message: str, client_id: Hashable):
+        self._enqueue(client_id, message)
+
+    async def send_bytes(self, data: bytes, client_id: Hashable):
+        self._enqueue(client_id, data)
+
+    async def broadcast(self, message: str):
+        self._send_to_clients(list(self.active_connections), message)
+
+    async def broadcast_bytes(self, data: bytes):
+        self._send_to_clients(list(self.active_connections), data)
@@ -21,23 +21,31 @@ const CameraStream: React.FC<CameraStreamProps> = ({ cameraId }) => {
     
     if (!ctx) return;
 
-    const img = new Image();
-    img.onload = () => {
-      // Set canvas dimensions to match image
-      canvas.width = img.width;
-      canvas.height = img.height;
-      
-      // Clear canvas and draw image
-      ctx.clearRect(0, 0, canvas.width, canvas.height);
-      ctx.drawImage(img, 0, 0);
-    };
+    // Decode the JPEG blob off the main thread
+    let cancelled = false;
+    createImageBitmap(currentStream)
+      .then(bitmap => {
+        if (cancelled) {
+          bitmap.close();
+          return;
+        }
+        
+        // Set canvas dimensions to match image
+        canvas.width = bitmap.width;
+        canvas.height = bitmap.height;
+        
+        // Clear canvas and draw image
+        ctx.clearRect(0, 0, canvas.width, canvas.height);
+        ctx.drawImage(bitmap, 0, 0);
+        bitmap.close();
+      })
+      .catch(() => {
+        console.error('Failed to load camera frame');
+      });
 
-    img.onerror = () => {
-      console.error('Failed to load camera frame');
+    return () => {
+      cancelled = true;
     };
-
-    // Convert base64 to image
-    img.src = `data:image/jpeg;base64,${currentStream}`;
   }, [currentStream]);
 
   if (!status?.isStreaming) {
@@ -166,27 +166,36 @@ const InteractiveCameraStream: React.FC<InteractiveCameraStreamProps> = ({
     
     if (!ctx) return;
 
-    const img = new Image();
-    img.onload = () => {
-      // Set canvas dimensions to match image
-      canvas.width = img.width;
-      canvas.height = img.height;
-      
-      // Clear canvas and draw image
-      ctx.clearRect(0, 0, canvas.width, canvas.height);
-      ctx.drawImage(img, 0, 0);
+    // Decode the JPEG blob off the main thread
+    let cancelled = false;
+    createImageBitmap(currentStream)
+      .then(bitmap => {
+        if (cancelled) {
+          bitmap.close();
+          return;
+        }
 
-      // Draw bounding boxes if enabled and detections exist
-      if (enableObjectClick && detections && detections.detections) {
-        drawBoundingBoxes(ctx, detections.detections);
-      }
-    };
+        // Set canvas dimensions to match image
+        canvas.width = bitmap.width;
+        canvas.height = bitmap.height;
+        
+        // Clear canvas and draw image
+        ctx.clearRect(0, 0, canvas.width, canvas.height);
+        ctx.drawImage(bitmap, 0, 0);
+        bitmap.close();
 
-    img.onerror = () => {
-      console.error('Failed to load camera frame');
-    };
+        // Draw bounding boxes if enabled and detections exist
+        if (enableObjectClick && detections && detections.detections) {
+          drawBoundingBoxes(ctx, detections.detections);
+        }
+      })
+      .catch(() => {
+        console.error('Failed to load camera frame');
+      });
 
-    img.src = `data:image/jpeg;base64,${currentStream}`;
+    return () => {
+      cancelled = true;
+    };
   }, [currentStream, detections, enableObjectClick]);
 
   const drawBoundingBoxes = (ctx: CanvasRenderingContext2D, detections: Detection[]) => {
@@ -8,7 +8,7 @@ interface CameraContextType {
   cameras: Camera[];
   cameraStatuses: CameraStatus;
   detectionResults: { [cameraId: string]: DetectionResult };
-  cameraStreams: { [cameraId: string]: string };
+  cameraStreams: { [cameraId: string]: Blob };
   objectCounts: { [cameraId: string]: ObjectCount };
   cameraSettings: { [cameraId: string]: CameraSettings };
   addCamera: (camera: { name: string; ip_address: string; port: number }) => Promise<void>;
@@ -37,11 +37,20 @@ interface CameraProviderProps {
   children: ReactNode;
 }
 
+// Binary message layout: 4-byte big-endian header length, UTF-8 JSON header, JPEG bytes
+const textDecoder = new TextDecoder();
+
+const decodeBinaryMessage = (buffer: ArrayBuffer) => {
+  const headerLength = new DataView(buffer).getUint32(0);
+  const header = JSON.parse(textDecoder.decode(new Uint8Array(buffer, 4, headerLength)));
+  return { ...header, frame: new Blob([new Uint8Array(buffer, 4 + headerLength)], { type: 'image/jpeg' }) };
+};
+
 export const CameraProvider: React.FC<CameraProviderProps> = ({ children }) => {
   const [cameras, setCameras] = useState<Camera[]>([]);
   const [cameraStatuses, setCameraStatuses] = useState<CameraStatus>({});
   const [detectionResults, setDetectionResults] = useState<{ [cameraId: string]: DetectionResult }>({});
-  const [cameraStreams, setCameraStreams] = useState<{ [cameraId: string]: string }>({});
+  const [cameraStreams, setCameraStreams] = useState<{ [cameraId: string]: Blob }>({});
   const [objectCounts, setObjectCounts] = useState<{ [cameraId: string]: ObjectCount }>({});
   const [cameraSettings, setCameraSettings] = useState<{ [cameraId: string]: CameraSettings }>({});
   const [isLoading, setIsLoading] = useState(true);
@@ -67,7 +76,7 @@ export const CameraProvider: React.FC<CameraProviderProps> = ({ children }) => {
 
     const handleSocketMessage = (data: any) => {
       try {
-        const message = typeof data === 'string' ? JSON.parse(data) : data;
+        const message = data instanceof ArrayBuffer ? decodeBinaryMessage(data) : JSON.parse(data);
 
         switch (message.type) {
           case 'frame':
@@ -21,6 +21,8 @@ export const SocketProvider = ({ children }: { children: ReactNode }) => {
 
   useEffect(() => {
     const socket = new WebSocket("ws://localhost:8000/ws");
+    // Camera frames arrive as binary messages (length-prefixed JSON header + JPEG)
+    socket.binaryType = "arraybuffer";
 
     socket.onopen = () => {
       console.log("WebSocket connected");
@@ -40,6 +42,7 @@ export const SocketProvider = ({ children }: { children: ReactNode }) => {
     };
 
     socket.onmessage = (event) => {
+      if (typeof event.data !== "string") return; // Binary frames are handled by CameraContext
       try {
         const data = JSON.parse(event.data);
         console.log("Received:", data);
@@ -47,7 +47,7 @@ export interface DetectionResult {
 export interface WebSocketMessage {
   type: 'frame' | 'detection' | 'detection_status' | 'pong';
   camera_id?: string;  // Changed from number to string
-  frame?: string;
+  frame?: Blob;
   detections?: Detection[];
   object_counts?: ObjectCount;
   enabled?: boolean;